@@ -1,81 +1,46 @@
 import streamlit as st
 import os
-import networkx as nx
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain.memory import ConversationBufferWindowMemory
-from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AnyMessage
-from tools.search_ddg import search_ddg
-from tools.fetch_page import fetch_page
-
-# System Promptの作成
-CUSTOM_SYSTEM_PROMPT = """
-あなたの役割
-あなたの役割はuserの入力する質問に対して、インターネットでWebページを調査をし、回答することです。
-あなたが従わなければいけないルール
-回答はできるだけ短く、要約して回答してください
-文章が長くなる場合は改行して見やすくしてください
-回答の最後に改行した後、参照したページのURLを記載してください
-"""
-
-# LangChain Agent
-def create_langchain_agent():
-    tools = [search_ddg, fetch_page]
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", CUSTOM_SYSTEM_PROMPT),
-        ("user", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad")
-    ])
-
-    llm = ChatOpenAI(temperature=0., model_name="gpt-3.5-turbo")
-
-    agent = create_tool_calling_agent(llm, tools, prompt)
-
-    return AgentExecutor(
-        agent=agent,
-        tools=tools,
-        verbose=True,
-    )
-
-# NetworkX based Agent
-def create_networkx_agent():
-    G = nx.DiGraph()
-    G.add_node("start")
-    G.add_node("search")
-    G.add_node("fetch")
-    G.add_node("answer")
-    G.add_edge("start", "search")
-    G.add_edge("search", "fetch")
-    G.add_edge("fetch", "answer")
-
-    llm = ChatOpenAI(temperature=0, model_name="gpt-3.5-turbo")
-    
-    def process_node(node, query):
-        if node == "search":
-            return search_ddg(query)
-        elif node == "fetch":
-            urls = [result['url'] for result in query]
-            return [fetch_page(url) for url in urls[:2]]  # Fetch first 2 URLs
-        elif node == "answer":
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", CUSTOM_SYSTEM_PROMPT),
-                ("user", f"Based on the following information, answer the user's question: {query}")
-            ])
-            return llm(prompt.format_messages(input=str(query)))
-        return None
-
-    def run_agent(query):
-        current_node = "start"
-        result = query
-        while current_node != "answer":
-            next_nodes = list(G.successors(current_node))
-            if next_nodes:
-                current_node = next_nodes[0]
-                result = process_node(current_node, result)
-        return result
-
-    return run_agent
+from core.agents import get_agent, CUSTOM_SYSTEM_PROMPT, MODEL_NAME, QUERY_REWRITES
+from core.resources import get_resource_cache, use_api_key
+from core.streaming import stream_langchain_agent, stream_networkx_agent, replay_stream
+from core.llm_cache import get_llm_cache, openai_embedder
+from core.conversation import get_conversation, openai_summarizer
+from core.render import ThrottledRenderer
+from tools.tracing import trace, timeline_markdown
+from tools.resilience import upstream_stats
+from tools.prefetch import prefetch_turn, prefetch_stats
+from tools.dedup import dedup_turn, dedup_stats
+
+
+def render_stream(stream):
+    """ツールの進み具合と回答のトークンを、届いた順に画面へ表示する"""
+    progress = st.container()
+    answer_placeholder = st.empty()
+    renderer = ThrottledRenderer(answer_placeholder)
+    for kind, payload in stream:
+        if kind == "tool_start":
+            progress.write(f"🔧 {payload['name']} を実行中: {payload['input']}")
+        elif kind == "node_done":
+            progress.write(f"✅ {payload['name']}（{payload['wall_sec']:.2f}秒）")
+        elif kind == "token":
+            renderer.write(payload)
+    return answer_placeholder
+
+
+def render_history(conversation):
+    """要約と直近のターンだけを表示する（会話が長くなっても描画する量は増えない）"""
+    if conversation.summary:
+        with st.expander(f"これまでの会話の要約（{conversation.total_turns - len(conversation.recent())}ターン分）"):
+            st.write(conversation.summary)
+    for turn in conversation.recent():
+        with st.chat_message(turn["role"]):
+            st.write(turn["content"])
+
+
+def answer_text(agent_type, result):
+    if agent_type == "LangChain Agent":
+        return result["output"]
+    return result.content
 
 # Streamlit UI
 st.title("インターネットで調べ物をしてくれるエージェント")
@@ -83,21 +48,88 @@ st.title("インターネットで調べ物をしてくれるエージェント"
 api_key = st.text_input("OpenAI API Keyを入力してください", type="password")
 if api_key:
     os.environ["OPENAI_API_KEY"] = api_key
+    use_api_key(st.session_state, api_key)
 
     agent_type = st.radio("Agentの種類を選択してください", ("LangChain Agent", "NetworkX Agent"))
+    # 直近のターンはそのまま、古いターンは要約してAgentに渡す（セッションのメモリとプロンプトが一定に保たれる）
+    # 要約に使うAPIキーが変わることがあるので、summarizeは毎回付け直す
+    conversation = get_conversation(st.session_state)
+    conversation.summarize = openai_summarizer(api_key, MODEL_NAME)
+    render_history(conversation)
 
     query = st.text_input("質問を入力してください")
+    streaming = st.checkbox("回答をストリーミング表示する", value=True)
+    prefetch = st.checkbox("検索結果の上位ページを先読みする（LangChain Agent）", value=False)
+    # NetworkX Agentは、LLMで言い換えた検索クエリでも並行して検索できる
+    agent_options = {}
+    if agent_type == "NetworkX Agent":
+        agent_options["query_rewrites"] = int(st.number_input(
+            "言い換えた検索クエリの数（NetworkX Agent）", min_value=0, max_value=5, value=QUERY_REWRITES
+        ))
 
     if st.button("実行"):
-        if agent_type == "LangChain Agent":
-            agent = create_langchain_agent()
-            response = agent.invoke({'input': query})
-            st.write("（Agentの回答）", response["output"])
-
-        elif agent_type == "NetworkX Agent":
-            agent = create_networkx_agent()
-            response = agent(query)
-            st.write("（Agentの回答）", response.content)
+        # 質問1回分の処理（LLM・ツール呼び出し）をスパンとして記録し、最後にタイムラインを表示する
+        with trace("app", agent=agent_type, streaming=streaming) as run_trace:
+            # 同じ（設定によってはほぼ同じ）質問の回答はキャッシュから返す
+            cache = get_llm_cache()
+            cache_model = f"{agent_type}/{MODEL_NAME}"
+            embed = openai_embedder(api_key)
+            cache_input = conversation.cache_key(query)
+            history = conversation.messages()
+            cached = cache.get(cache_model, CUSTOM_SYSTEM_PROMPT, cache_input, embed=embed)
+            run_trace.set(llm_cache_hit=cached is not None)
+            agent = get_agent(agent_type, api_key, **agent_options) if cached is None else None
+            timings = {}
+
+            if streaming:
+                if cached is not None:
+                    # キャッシュした回答も、ストリーミングと同じ表示処理で再生する
+                    stream = replay_stream(cached)
+                elif agent_type == "LangChain Agent":
+                    stream = stream_langchain_agent(agent, query, chat_history=history, prefetch=prefetch)
+                else:
+                    stream = stream_networkx_agent(agent, query, timings=timings, history=history)
+                answer_placeholder = render_stream(stream)
+                answer = cached if cached is not None else answer_text(agent_type, stream.result)
+                answer_placeholder.write(f"（Agentの回答） {answer}")
+            else:
+                if cached is not None:
+                    answer = cached
+                elif agent_type == "LangChain Agent":
+                    with prefetch_turn(enabled=prefetch), dedup_turn():
+                        answer = answer_text(agent_type, agent.invoke({'input': query, 'chat_history': history}))
+                else:
+                    answer = answer_text(agent_type, agent(query, timings=timings, history=history))
+                st.write("（Agentの回答）", answer)
+
+            if cached is None:
+                cache.put(cache_model, CUSTOM_SYSTEM_PROMPT, cache_input, answer, embed=embed)
+            conversation.append("user", query)
+            conversation.append("assistant", answer)
+
+        if timings:
+            st.caption(" / ".join(f"{node}: {t['wall_sec']:.2f}秒" for node, t in timings.items()))
+        if streaming:
+            ttft = f"{stream.ttft_sec:.2f}秒" if stream.ttft_sec is not None else "-"
+            st.caption(f"最初のトークンまで: {ttft} / 全体: {stream.total_sec:.2f}秒")
+
+        stats = get_resource_cache().stats()
+        st.caption(f"Agentの再利用: {stats['hits']}回（構築時間 {stats['saved_sec']:.2f}秒を節約）")
+        stats = cache.stats()
+        st.caption(f"回答キャッシュ: ヒット率 {stats['hit_ratio']:.0%}（完全一致 {stats['exact_hits']} / 類似 {stats['semantic_hits']}）")
+        stats = dedup_stats()
+        if any(stats.values()):
+            st.caption(f"重複ページの除外: 取得しなかった検索結果 {stats['fetches_avoided']}件 / "
+                       f"除いたページ {stats['pages_dropped']}件（{stats['tokens_avoided']}トークン）")
+        if prefetch:
+            stats = prefetch_stats()
+            st.caption(f"先読み: ヒット率 {stats['hit_ratio']:.0%}（{stats['hits']} / {stats['prefetched']}件、"
+                       f"使われなかった取得 {stats['wasted_bytes'] / 1024:.0f}KB）")
+        unhealthy = [name for name, upstream in upstream_stats().items() if upstream["state"] != "closed"]
+        if unhealthy:
+            st.caption(f"失敗が続いているため一時的に呼び出しを止めている接続先: {', '.join(unhealthy)}")
+        with st.expander("タイムライン"):
+            st.markdown(timeline_markdown(run_trace))
 
 else:
     st.warning("OpenAI API Keyを入力してください")
@@ -1,60 +1,74 @@
 import streamlit as st
 import os
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.callbacks import StreamlitCallbackHandler
-from tools.search_ddg import search_ddg
-from tools.fetch_page import fetch_page
-
-CUSTOM_SYSTEM_PROMPT = """
-あなたの役割
-あなたの役割はuserの入力する質問に対して、インターネットでWebページを調査をし、回答することです。
-あなたが従わなければいけないルール
-回答はできるだけ短く、要約して回答してください
-文章が長くなる場合は改行して見やすくしてください
-回答の最後に改行した後、参照したページのURLを記載してください
-"""
-
-def create_agent():
-    tools = [search_ddg, fetch_page]
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", CUSTOM_SYSTEM_PROMPT),
-        ("user", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad")
-    ])
-
-    llm = ChatOpenAI(temperature=0., model_name="gpt-3.5-turbo")
-    agent = create_tool_calling_agent(llm, tools, prompt)
-    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+from core.agents import get_agent, CUSTOM_SYSTEM_PROMPT, MODEL_NAME
+from core.resources import use_api_key
+from core.llm_cache import get_llm_cache, openai_embedder
+from core.conversation import get_conversation, openai_summarizer
+from tools.tracing import trace, timeline_markdown
+from tools.prefetch import prefetch_turn
+from tools.dedup import dedup_turn
 
 st.title("インターネットで調べ物をしてくれるエージェント")
 
 api_key = st.text_input("OpenAI API Keyを入力してください", type="password")
 if api_key:
     os.environ["OPENAI_API_KEY"] = api_key
+    use_api_key(st.session_state, api_key)
+
+    # 直近のターンはそのまま、古いターンは要約してAgentに渡す
+    # 要約に使うAPIキーが変わることがあるので、summarizeは毎回付け直す
+    conversation = get_conversation(st.session_state)
+    conversation.summarize = openai_summarizer(api_key, MODEL_NAME)
+    if conversation.summary:
+        with st.expander("これまでの会話の要約"):
+            st.write(conversation.summary)
+    for turn in conversation.recent():
+        with st.chat_message(turn["role"]):
+            st.write(turn["content"])
 
     query = st.text_input("質問を入力してください")
 
     if st.button("実行"):
-        agent = create_agent()
-        
-        st.write("推論過程:")
-        output_container = st.empty()
-        
         def process_output(output):
             return output.replace("Human:", "ユーザー:").replace("AI:", "アシスタント:")
 
-        callback = StreamlitCallbackHandler(output_container, max_thought_containers=10, expand_new_thoughts=True, collapse_completed_thoughts=False)
-        
-        with st.spinner("エージェントが作業中..."):
-            response = agent.invoke(
-                {"input": query},
-                config={"callbacks": [callback]}
-            )
-        
-        st.write("最終回答:")
-        st.write(process_output(response["output"]))
+        # 質問1回分の処理（LLM・ツール呼び出し）をスパンとして記録し、最後にタイムラインを表示する
+        with trace("app_01", agent="LangChain Agent") as run_trace:
+            # 同じ（設定によってはほぼ同じ）質問の回答はキャッシュから返す
+            cache = get_llm_cache()
+            cache_model = f"LangChain Agent/{MODEL_NAME}"
+            embed = openai_embedder(api_key)
+            cache_input = conversation.cache_key(query)
+            cached = cache.get(cache_model, CUSTOM_SYSTEM_PROMPT, cache_input, embed=embed)
+            run_trace.set(llm_cache_hit=cached is not None)
+            if cached is not None:
+                st.write("最終回答（キャッシュ）:")
+                st.write(process_output(cached))
+                answer = cached
+            else:
+                agent = get_agent("LangChain Agent", api_key)
+            
+                st.write("推論過程:")
+                output_container = st.empty()
+
+                from langchain.callbacks import StreamlitCallbackHandler
+                callback = StreamlitCallbackHandler(output_container, max_thought_containers=10, expand_new_thoughts=True, collapse_completed_thoughts=False)
+            
+                with st.spinner("エージェントが作業中..."), prefetch_turn(), dedup_turn():
+                    response = agent.invoke(
+                        {"input": query, "chat_history": conversation.messages()},
+                        config={"callbacks": [callback]}
+                    )
+                answer = response["output"]
+                cache.put(cache_model, CUSTOM_SYSTEM_PROMPT, cache_input, answer, embed=embed)
+            
+                st.write("最終回答:")
+                st.write(process_output(answer))
+            conversation.append("user", query)
+            conversation.append("assistant", answer)
+
+        with st.expander("タイムライン"):
+            st.markdown(timeline_markdown(run_trace))
 
 else:
     st.warning("OpenAI API Keyを入力してください")
\ No newline at end of file
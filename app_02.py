@@ -1,7 +1,12 @@
 import streamlit as st
-import google.generativeai as genai
 from typing import Dict, Any
 import json
+from collections import deque
+from core.resources import api_key_fingerprint, get_resource_cache, use_api_key
+from core.gemini_agent import run_tool_loop
+from core.llm_cache import get_llm_cache, gemini_embedder
+from core.conversation import get_conversation, gemini_summarizer
+from tools.tracing import trace, annotate, timeline_markdown
 
 # Streamlit UI設定
 st.set_page_config(page_title="Geminiエージェントチャットボット", layout="wide")
@@ -18,50 +23,25 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# セッション状態の初期化
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+# セッション状態の初期化（推論過程は直近の数回分だけ残す。チャット履歴はモデルの初期化後に作る）
+REASONING_HISTORY_LIMIT = 5
 if 'reasoning_history' not in st.session_state:
-    st.session_state.reasoning_history = []
+    st.session_state.reasoning_history = deque(maxlen=REASONING_HISTORY_LIMIT)
 
-# モックツールの定義
-def search_web(query: str) -> str:
-    return f"Web検索結果: {query}に関する情報"
+# Geminiモデルの設定と初期化（モデルは再実行をまたいで使い回す）
+MODEL_NAME = 'gemini-pro'
 
-def fetch_page(url: str) -> str:
-    return f"{url}の内容"
-
-tools = [
-    {
-        "name": "search_web",
-        "description": "Web検索を行い、結果を返します。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {"type": "string", "description": "検索クエリ"}
-            },
-            "required": ["query"]
-        }
-    },
-    {
-        "name": "fetch_page",
-        "description": "指定されたURLのWebページの内容を取得します。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "url": {"type": "string", "description": "取得するWebページのURL"}
-            },
-            "required": ["url"]
-        }
-    }
-]
-
-# Geminiモデルの設定と初期化
 def initialize_model(api_key: str):
+    import google.generativeai as genai  # 起動を速くするため、使うときにimportする
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-pro')
+    use_api_key(st.session_state, api_key)
+    return get_resource_cache().get_or_build(
+        "gemini", (api_key_fingerprint(api_key), MODEL_NAME), lambda: genai.GenerativeModel(MODEL_NAME)
+    )
 
 # エージェントの実行とストリーミング
+OBSERVATION_CHARS = 500  # 推論過程に表示するツール結果の文字数
+
 def run_agent(model, user_input: str) -> None:
     system_prompt = """
     あなたは高度なAIアシスタントです。ユーザーの質問に答えるために、以下のステップを踏んでください：
@@ -87,45 +67,73 @@ def run_agent(model, user_input: str) -> None:
     }
     ```
 
-    ユーザーの質問に答えるまで、このプロセスを繰り返してください。
+    ツールは関数呼び出し（function calling）で実行してください。独立した情報が複数必要な場合は、
+    1回の応答で複数のツールをまとめて呼び出してください（同時に実行されます）。
+    ツールの結果を受け取ったら、ユーザーの質問に答えるまで、このプロセスを繰り返してください。
     """
 
-    prompt = f"{system_prompt}\n\nユーザーの質問: {user_input}\n\n回答:"
+    # 会話の要約と直近のターンを文脈として渡す（会話が長くなってもプロンプトの大きさは一定）
+    conversation = st.session_state.chat_history
+    context = conversation.as_text()
+    cache_input = conversation.cache_key(user_input)
+    conversation.append("user", user_input)
+    history = f"\n\nこれまでの会話:\n{context}" if context else ""
+    prompt = f"{system_prompt}{history}\n\nユーザーの質問: {user_input}\n\n回答:"
     
     reasoning_placeholder = st.empty()
     response_placeholder = st.empty()
-    full_response = ""
+
+    # 同じ質問の回答がキャッシュにあれば、推論過程ごと表示し直す
+    cache = get_llm_cache()
+    embed = gemini_embedder()
+    cached = cache.get(MODEL_NAME, system_prompt, cache_input, embed=embed)
+    annotate(llm_cache_hit=cached is not None)
+    if cached is not None:
+        cached = json.loads(cached)
+        for step in cached["steps"]:
+            display_reasoning(step, reasoning_placeholder)
+        response_placeholder.markdown(f"**回答（キャッシュ）:** {cached['conclusion']}")
+        conversation.append("assistant", cached["conclusion"])
+        st.session_state.reasoning_history.append(cached["steps"])
+        return
+
+    current_step = {}
     reasoning_steps = []
 
-    for chunk in model.generate_content(prompt, tools=tools, stream=True):
-        if chunk.text:
-            full_response += chunk.text
-            try:
-                response_json = json.loads(full_response)
-                display_reasoning(response_json, reasoning_placeholder)
-                reasoning_steps.append(response_json)
-            except json.JSONDecodeError:
-                pass
-
-    # ツールの実行（実際のAPIコールの代わりにモック）
-    if reasoning_steps and "行動" in reasoning_steps[-1] and "tool" in reasoning_steps[-1]["行動"]:
-        tool_name = reasoning_steps[-1]["行動"]["tool"]
-        if tool_name == "search_web":
-            result = search_web(reasoning_steps[-1]["行動"]["params"]["query"])
-        elif tool_name == "fetch_page":
-            result = fetch_page(reasoning_steps[-1]["行動"]["params"]["url"])
-        else:
-            result = "未知のツールが呼び出されました。"
-        
-        reasoning_steps[-1]["観察"] = result
-        display_reasoning(reasoning_steps[-1], reasoning_placeholder)
+    # 確定したフィールドやツールの結果から順に表示する
+    def on_event(kind, payload):
+        nonlocal current_step
+        if kind == "field":
+            current_step[payload[0]] = payload[1]
+            display_reasoning(current_step, reasoning_placeholder)
+        elif kind == "step":
+            reasoning_steps.append(payload)
+            current_step = {}
+        elif kind == "tool_call":
+            display_reasoning({"行動": {"tool": payload["name"], "params": payload["args"]}}, reasoning_placeholder)
+        elif kind == "tool_result":
+            observation = json.dumps(payload["result"], ensure_ascii=False)[:OBSERVATION_CHARS]
+            step = {"行動": {"tool": payload["name"], "params": payload["args"]}, "観察": observation}
+            reasoning_steps.append(step)
+            display_reasoning(step, reasoning_placeholder)
+
+    # ツールを実際に呼び出しながら、回答が出るまで繰り返す
+    result = run_tool_loop(model, prompt, on_event=on_event)
 
     # 最終的な結論を表示
-    final_conclusion = reasoning_steps[-1].get("結論", "結論が見つかりませんでした。")
+    conclusions = [step["結論"] for step in reasoning_steps if "結論" in step]
+    final_conclusion = conclusions[-1] if conclusions else (result["text"] or "結論が見つかりませんでした。")
+    if result["stopped"]:
+        final_conclusion += f"\n\n（{result['stopped']} の上限に達したため打ち切りました）"
+    elif conclusions:
+        # 上限で打ち切った不完全な回答はキャッシュしない
+        cache.put(MODEL_NAME, system_prompt, cache_input,
+                  json.dumps({"conclusion": final_conclusion, "steps": reasoning_steps}, ensure_ascii=False),
+                  embed=embed)
     response_placeholder.markdown(f"**回答:** {final_conclusion}")
 
     # チャット履歴と推論履歴に追加
-    st.session_state.chat_history.append({"role": "assistant", "content": final_conclusion})
+    conversation.append("assistant", final_conclusion)
     st.session_state.reasoning_history.append(reasoning_steps)
 
 def display_reasoning(response: Dict[str, Any], placeholder: st.empty) -> None:
@@ -155,10 +163,16 @@ def main():
 
         if api_key:
             model = initialize_model(api_key)
+            # 直近のターンはそのまま、古いターンはGeminiで要約して残す（APIキーが変わることがあるので毎回付け直す）
+            conversation = get_conversation(st.session_state, key="chat_history")
+            conversation.summarize = gemini_summarizer(model)
 
-            # チャット履歴の表示
+            # チャット履歴の表示（要約と直近のターンだけ）
             st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
-            for message in st.session_state.chat_history:
+            if conversation.summary:
+                with st.expander("これまでの会話の要約"):
+                    st.write(conversation.summary)
+            for message in conversation.recent():
                 if message["role"] == "user":
                     st.markdown(f"<div class='user-message'>👤 {message['content']}</div>", unsafe_allow_html=True)
                 else:
@@ -168,11 +182,12 @@ def main():
             # ユーザー入力
             user_input = st.text_input("質問を入力してください", key="user_input")
             if user_input:
-                st.session_state.chat_history.append({"role": "user", "content": user_input})
                 st.markdown(f"<div class='user-message'>👤 {user_input}</div>", unsafe_allow_html=True)
 
-                with st.spinner("回答を生成中..."):
+                # 質問1回分の処理（LLM・ツール呼び出し）をスパンとして記録する
+                with st.spinner("回答を生成中..."), trace("app_02", model=MODEL_NAME) as run_trace:
                     run_agent(model, user_input)
+                st.session_state.last_timeline = timeline_markdown(run_trace)
 
         else:
             st.warning("Google API Keyを入力してください")
@@ -185,6 +200,9 @@ def main():
         if st.session_state.reasoning_history:
             for step in st.session_state.reasoning_history[-1]:
                 display_reasoning(step, st.empty())
+        if "last_timeline" in st.session_state:
+            with st.expander("タイムライン"):
+                st.markdown(st.session_state.last_timeline)
         st.markdown("</div>", unsafe_allow_html=True)
 
 if __name__ == "__main__":
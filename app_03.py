@@ -1,6 +1,10 @@
 import streamlit as st
-import google.generativeai as genai
-import time
+from collections import deque
+from core.render import ThrottledRenderer
+from core.llm_cache import get_llm_cache, gemini_embedder, replay_chunks
+from core.gemini_agent import usage_attrs
+from core.conversation import get_conversation, gemini_summarizer
+from tools.tracing import trace, span, timeline_markdown
 
 # Streamlit page config
 st.set_page_config(page_title="Gemini Agent", layout="wide")
@@ -37,11 +41,12 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
+# Initialize session state. Both stores are bounded so per-session memory stays flat:
+# older chat turns are compacted into a summary, and only the latest log entries are kept
+INFERENCE_LOG_LIMIT = 50
+messages = get_conversation(st.session_state, key="messages")
 if 'inference_log' not in st.session_state:
-    st.session_state.inference_log = []
+    st.session_state.inference_log = deque(maxlen=INFERENCE_LOG_LIMIT)
 
 # Gemini system prompt
 SYSTEM_PROMPT = """
@@ -58,20 +63,14 @@ You are an advanced AI assistant designed to provide comprehensive and detailed
 Throughout your response, maintain a professional and informative tone. Your goal is to provide a response that is not only accurate but also educational and thought-provoking.
 """
 
-# Mock functions for web search and content fetching
-def search_web(query):
-    time.sleep(1)  # Simulate API call
-    return f"[MOCK] Extensive search results for: {query}"
-
-def fetch_content(url):
-    time.sleep(1)  # Simulate API call
-    return f"[MOCK] Detailed content from: {url}"
-
 # Initialize Gemini model
+MODEL_NAME = 'gemini-1.5-flash-latest'
+
 @st.cache_resource
 def init_model(api_key):
+    import google.generativeai as genai  # Imported lazily to keep cold starts fast
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-1.5-flash-latest')
+    return genai.GenerativeModel(MODEL_NAME)
 
 # Main chat interface
 chat_col, inference_col = st.columns([2, 1])
@@ -79,12 +78,19 @@ chat_col, inference_col = st.columns([2, 1])
 with chat_col:
     st.title("Gemini AI Assistant")
     
-    for message in st.session_state.messages:
+    # Render only the summary and the recent turns, not the whole session
+    if messages.summary:
+        with st.expander("Earlier conversation (summary)"):
+            st.markdown(messages.summary)
+    for message in messages.recent():
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
     
     if prompt := st.chat_input("Ask your question here"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        # Capture the context before this turn is added; it keys the cache and goes into the prompt
+        context = messages.as_text()
+        cache_input = messages.cache_key(prompt)
+        messages.append("user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
 
@@ -92,19 +98,47 @@ with chat_col:
         if 'model' not in st.session_state:
             st.error("Please set up the API key first.")
         else:
-            with st.chat_message("assistant"):
-                message_placeholder = st.empty()
-                full_response = ""
-                for chunk in st.session_state.model.generate_content(
-                    f"{SYSTEM_PROMPT}\n\nUser question: {prompt}",
-                    stream=True
-                ):
-                    full_response += chunk.text
-                    message_placeholder.markdown(full_response + "▌")
-                message_placeholder.markdown(full_response)
+            # Record the cache lookup and the model call as spans for the timeline panel
+            with st.chat_message("assistant"), trace("app_03", model=MODEL_NAME) as run_trace:
+                # Coalesce chunks and re-render at a bounded rate instead of on every chunk
+                renderer = ThrottledRenderer(st.empty())
+                # Replay cached answers through the same renderer so the UI behaves identically
+                cache = get_llm_cache()
+                embed = gemini_embedder()
+                cached = cache.get(MODEL_NAME, SYSTEM_PROMPT, cache_input, embed=embed)
+                run_trace.set(llm_cache_hit=cached is not None)
+                if cached is not None:
+                    for chunk in replay_chunks(cached):
+                        renderer.write(chunk)
+                    full_response = renderer.close()
+                else:
+                    with span("llm", "llm", model=MODEL_NAME) as llm_span:
+                        chunk = None
+                        for chunk in st.session_state.model.generate_content(
+                            f"{SYSTEM_PROMPT}\n\nConversation so far:\n{context}\n\nUser question: {prompt}"
+                            if context else f"{SYSTEM_PROMPT}\n\nUser question: {prompt}",
+                            stream=True
+                        ):
+                            if "ttft_sec" not in llm_span.attrs:
+                                llm_span.set(ttft_sec=llm_span.elapsed())
+                            renderer.write(chunk.text)
+                        full_response = renderer.close()
+                        llm_span.set(**usage_attrs(chunk))
+                    cache.put(MODEL_NAME, SYSTEM_PROMPT, cache_input, full_response, embed=embed)
             
-            st.session_state.messages.append({"role": "assistant", "content": full_response})
-            st.session_state.inference_log.append(f"Processed query: {prompt}\nGenerated response length: {len(full_response)} characters")
+            stats = renderer.stats()
+            cache_stats = cache.stats()
+            tokens = next((s.attrs for s in run_trace.spans if s.kind == "llm"), {})
+            messages.append("assistant", full_response)
+            st.session_state.inference_log.append(
+                f"Processed query: {prompt}\nGenerated response length: {len(full_response)} characters\n"
+                f"Chunks: {stats['chunks']}, renders: {stats['renders']}, bytes sent: {stats['bytes_sent']}\n"
+                f"Cache: {'hit' if cached is not None else 'miss'} "
+                f"(hit ratio {cache_stats['hit_ratio']:.0%})\n"
+                f"Total: {run_trace.root.wall_sec:.2f}s, TTFT: {tokens.get('ttft_sec', 0):.2f}s, "
+                f"tokens: {tokens.get('prompt_tokens', '-')} in / {tokens.get('completion_tokens', '-')} out"
+            )
+            st.session_state.last_timeline = timeline_markdown(run_trace)
 
 # Sidebar for API key input
 with st.sidebar:
@@ -114,6 +148,7 @@ with st.sidebar:
         if api_key:
             try:
                 st.session_state.model = init_model(api_key)
+                messages.summarize = gemini_summarizer(st.session_state.model)
                 st.success("AI Assistant initialized successfully!")
             except Exception as e:
                 st.error(f"Error initializing assistant: {str(e)}")
@@ -127,6 +162,9 @@ with inference_col:
     
     log_content = "\n".join(st.session_state.inference_log)
     inference_log.markdown(f'<div class="inference-log">{log_content}</div>', unsafe_allow_html=True)
+    if 'last_timeline' in st.session_state:
+        with st.expander("Timeline"):
+            st.markdown(st.session_state.last_timeline)
 
 # Display warning if model is not initialized
 if 'model' not in st.session_state:
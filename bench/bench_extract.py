@@ -0,0 +1,91 @@
+"""本文抽出エンジンのマイクロベンチマーク
+
+ローカルのHTMLコーパス（ディレクトリ内の *.html）に対して各エンジンの
+スループットと出力の品質を比較します。品質は、同じ名前の *.txt（正解テキスト）が
+あればそれと、なければreadabilityの出力との単語F1で測ります。
+
+    python -m bench.bench_extract path/to/corpus --repeat 3
+"""
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+from collections import Counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.extract import ENGINES, extract_readability  # noqa: E402
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _tokens(text):
+    # 日本語は単語区切りがないので、英数字以外は1文字ずつ数える
+    tokens = []
+    for word in _TOKEN_RE.findall(text.lower()):
+        if word.isascii():
+            tokens.append(word)
+        else:
+            tokens.extend(word)
+    return Counter(tokens)
+
+
+def token_f1(candidate, reference):
+    cand, ref = _tokens(candidate), _tokens(reference)
+    overlap = sum((cand & ref).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(cand.values())
+    recall = overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def load_corpus(corpus_dir):
+    pages = []
+    for path in sorted(Path(corpus_dir).glob("*.html")):
+        html = path.read_text(encoding="utf-8", errors="replace")
+        gold = path.with_suffix(".txt")
+        reference = gold.read_text(encoding="utf-8") if gold.exists() else extract_readability(html)[1]
+        pages.append((path.name, html, reference))
+    return pages
+
+
+def run(pages, engines, repeat):
+    total_bytes = sum(len(html.encode("utf-8")) for _, html, _ in pages)
+    rows = []
+    for name in engines:
+        engine = ENGINES[name]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            outputs = [engine(html)[1] for _, html, _ in pages]
+        elapsed = time.perf_counter() - start
+        f1 = sum(token_f1(out, ref) for out, (_, _, ref) in zip(outputs, pages)) / len(pages)
+        rows.append({
+            "engine": name,
+            "pages_per_sec": len(pages) * repeat / elapsed,
+            "mb_per_sec": total_bytes * repeat / elapsed / 1e6,
+            "f1": f1,
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="*.html（と任意で正解の *.txt）を置いたディレクトリ")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="カンマ区切りのエンジン名")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        parser.error(f"No *.html files in {args.corpus}")
+
+    print(f"{len(pages)} pages, repeat={args.repeat}")
+    print(f"{'engine':<12} {'pages/s':>10} {'MB/s':>8} {'F1':>6}")
+    for row in run(pages, args.engines.split(","), args.repeat):
+        print(f"{row['engine']:<12} {row['pages_per_sec']:>10.1f} {row['mb_per_sec']:>8.2f} {row['f1']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""ストリーミングJSONパースのベンチマーク
+
+長い合成ストリーム（```json で囲んだ推論ステップの連続）を小さなチャンクに分けて流し、
+従来の方法（チャンクごとに全体をjson.loadsし直す）とJsonStepParserの処理時間を比べます。
+
+    python -m bench.bench_json_stream --steps 10 100 1000 --chunk-chars 8
+    python -m bench.bench_json_stream --steps 1 --text-chars 20000 200000 --no-fence
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.json_stream import JsonStepParser  # noqa: E402
+
+
+def make_stream(steps, text_chars=200, fence=True):
+    body = "検索結果を確認して次の行動を決める。" * (text_chars // 18 + 1)
+    parts = ["以下が推論過程です。\n"] if fence else []
+    for i in range(steps):
+        step = {
+            "思考": body[:text_chars],
+            "行動": {"tool": "search_web", "params": {"query": f"クエリ {i}"}},
+            "観察": body[:text_chars],
+            "結論": f"ステップ{i}の結論",
+        }
+        text = json.dumps(step, ensure_ascii=False, indent=4)
+        parts.append(f"```json\n{text}\n```\n" if fence else text + "\n")
+    return "".join(parts)
+
+
+def chunked(stream, chunk_chars):
+    return [stream[i:i + chunk_chars] for i in range(0, len(stream), chunk_chars)]
+
+
+def naive(chunks):
+    # 従来のapp_02.run_agentと同じ処理（フェンスがあるので一度も成功しない）
+    full_response, steps = "", []
+    for chunk in chunks:
+        full_response += chunk
+        try:
+            steps.append(json.loads(full_response))
+        except json.JSONDecodeError:
+            pass
+    return steps
+
+
+def incremental(chunks):
+    parser, steps = JsonStepParser(), []
+    for chunk in chunks:
+        steps.extend(event[1] for event in parser.feed(chunk) if event[0] == "step")
+    return steps
+
+
+def measure(func, chunks):
+    start = time.perf_counter()
+    steps = func(chunks)
+    return time.perf_counter() - start, len(steps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--text-chars", type=int, nargs="+", default=[200],
+                        help="思考・観察フィールドの文字数")
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    parser.add_argument("--no-fence", action="store_true",
+                        help="フェンスなしで流す（従来の方法でも最初のステップはパースできる）")
+    parser.add_argument("--naive-max-chars", type=int, default=2_000_000,
+                        help="これより長いストリームでは従来の方法を測らない（二乗時間のため）")
+    args = parser.parse_args(argv)
+
+    print(f"{'steps':>6} {'text':>7} {'chars':>10} {'naive s':>10} {'parsed':>7} {'incremental s':>14} {'parsed':>7} {'MB/s':>8}")
+    for steps, text_chars in [(s, t) for s in args.steps for t in args.text_chars]:
+        stream = make_stream(steps, text_chars, fence=not args.no_fence)
+        chunks = chunked(stream, args.chunk_chars)
+        if len(stream) <= args.naive_max_chars:
+            naive_sec, naive_steps = measure(naive, chunks)
+            naive_col = f"{naive_sec:>10.3f} {naive_steps:>7}"
+        else:
+            naive_col = f"{'-':>10} {'-':>7}"
+        inc_sec, inc_steps = measure(incremental, chunks)
+        mb_per_sec = len(stream.encode("utf-8")) / inc_sec / 1e6
+        print(f"{steps:>6} {text_chars:>7} {len(stream):>10} {naive_col} {inc_sec:>14.3f} {inc_steps:>7} {mb_per_sec:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
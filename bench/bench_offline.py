@@ -0,0 +1,228 @@
+"""ネットワークやAPIキーなしで、ツールとAgentのレイテンシ・スループットを測るベンチマーク
+
+ローカルのHTTPサーバー（HTMLコーパス）、DDGSの代役、台本どおりに応答するチャットモデルに
+差し替えて、fetch_page・search_ddg・NetworkX Agent・LangChain Agentを実行し、
+p50/p95/p99のレイテンシとスループットを表示します。
+Agentはストリーミングで実行し、最初のトークンまでの時間（TTFT）も測ります。
+
+    python -m bench.bench_offline --requests 50 --concurrency 4
+    python -m bench.bench_offline --targets fetch_page --corpus path/to/corpus --latency-ms 200
+    python -m bench.bench_offline --json after.json --baseline before.json
+    python -m bench.bench_offline --targets langchain --prefetch
+
+既定では毎回別のURL・クエリを使うので、キャッシュに当たらない場合を測ります。
+--warm を付けると同じURL・クエリを繰り返し、キャッシュに当たる場合を測ります。
+NetworkX Agentはtiktokenのエンコーディングを使うので、初回だけはダウンロードが必要です
+（TIKTOKEN_CACHE_DIRに置いておけば、以降はオフラインで動きます）。
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import traceback
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# 手元のキャッシュを汚さないよう、toolsをimportする前に保存先を一時ディレクトリにする
+os.environ.setdefault("AGENT_CACHE_DIR", tempfile.mkdtemp(prefix="agent-bench-"))
+
+from langchain_core.messages import AIMessage, ToolMessage  # noqa: E402
+from bench.fakes import CorpusServer, FakeChatModel, fake_ddgs  # noqa: E402
+from tools.resilience import set_rate_limit, set_host_rate_limit  # noqa: E402
+
+TARGETS = ("fetch_page", "search_ddg", "networkx", "langchain")
+ANSWER = "ベンチマーク用の回答です。検索結果と取得したページをもとに、質問に短く答えます。" * 4
+_URL_RE = re.compile(r"http://127\.0\.0\.1:\d+/page/\d+(?:\?r=[\w-]+)?")
+
+
+def percentile(values, q):
+    """最近傍順位法でのパーセンタイル"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def _last_url(messages):
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            match = _URL_RE.search(str(message.content))
+            if match:
+                return match.group()
+    return "http://127.0.0.1:1/page/0"
+
+
+def install_fakes(server, args):
+    """DDGSとChatOpenAIを代役に差し替える（Agentを作る前に呼ぶ）"""
+    import langchain_openai
+    import tools.search_ddg
+
+    # 代役には上流のレート制限は要らない（かけると測りたい処理時間が見えなくなる）
+    set_rate_limit("ddg", None)
+    set_host_rate_limit(None)
+    tools.search_ddg.DDGS = fake_ddgs(server, results=args.search_results, latency_sec=args.search_ms / 1000)
+
+    # LangChain Agent: 検索 → 1件目のページを取得 → 回答、の順にツールを呼ぶ
+    tool_turns = [
+        lambda messages: AIMessage(content="", tool_calls=[
+            {"name": "search_ddg", "args": {"query": messages[-1].content}, "id": "call_search"}
+        ]),
+        lambda messages: AIMessage(content="", tool_calls=[
+            {"name": "fetch_page", "args": {"url": _last_url(messages)}, "id": "call_fetch"}
+        ]),
+        AIMessage(content=ANSWER),
+    ]
+    # NetworkX Agent: ツールは呼ばず、そのまま回答する
+    langchain_openai.ChatOpenAI = lambda **kwargs: FakeChatModel(
+        turns=[AIMessage(content=ANSWER)], tool_turns=tool_turns, tokens_per_sec=args.tokens_per_sec, latency_sec=args.llm_ms / 1000,
+        callbacks=kwargs.get("callbacks"), rate_limiter=kwargs.get("rate_limiter"),
+    )
+
+
+def make_targets(server, args):
+    """ターゲット名 -> 実行関数を作る関数
+
+    実行関数はリクエスト番号を受け取って1回実行し、AgentならTTFTを返します。
+    """
+    from tools.fetch_page import fetch_page
+    from tools.search_ddg import search_ddg
+    from core.agents import create_langchain_agent, create_networkx_agent
+    from core.streaming import stream_langchain_agent, stream_networkx_agent
+
+    def key(i):
+        return 0 if args.warm else i
+
+    def run_fetch_page(i):
+        result = fetch_page.func(server.url(key(i), request_id=None if args.warm else i))
+        if result["status"] != 200:
+            raise RuntimeError(f"status {result['status']}")
+
+    def run_search_ddg(i):
+        search_ddg.func(f"ベンチマーク {key(i)}")
+
+    def streamed(create_agent, stream_agent, **stream_kwargs):
+        agent = create_agent("sk-bench")
+        if hasattr(agent, "verbose"):
+            agent.verbose = False  # AgentExecutorのログ出力は測定の対象外
+
+        def run(i):
+            stream = stream_agent(agent, f"ベンチマークの質問 {key(i)}", **stream_kwargs)
+            for _ in stream:
+                pass
+            return stream.ttft_sec
+        return run
+
+    return {
+        "fetch_page": lambda: run_fetch_page,
+        "search_ddg": lambda: run_search_ddg,
+        "networkx": lambda: streamed(create_networkx_agent, stream_networkx_agent),
+        "langchain": lambda: streamed(create_langchain_agent, stream_langchain_agent, prefetch=args.prefetch),
+    }
+
+
+def run(func, requests, concurrency, warmup=1):
+    # プロセスプールの起動などの初回だけのコストを除くため、先に数回実行しておく
+    for i in range(warmup):
+        try:
+            func(-1 - i)
+        except Exception:
+            pass
+    latencies, ttfts, errors = [], [], []
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            ttft = func(i)
+        except Exception:
+            errors.append(traceback.format_exc(limit=3))
+            return
+        latencies.append(time.perf_counter() - start)
+        if ttft is not None:
+            ttfts.append(ttft)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall_sec = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50) if ttfts else None,
+        "throughput": len(latencies) / wall_sec,
+    }
+
+
+def _ms(value):
+    return f"{value * 1000:>9.1f}" if value is not None else f"{'-':>9}"
+
+
+def print_rows(rows, baseline=None):
+    print(f"{'target':<11} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft ms':>9} {'req/s':>8}")
+    for name, row in rows.items():
+        line = (f"{name:<11} {row['requests']:>5} {row['errors']:>4} {_ms(row['p50'])} {_ms(row['p95'])} "
+                f"{_ms(row['p99'])} {_ms(row['ttft_p50'])} {row['throughput']:>8.2f}")
+        before = (baseline or {}).get(name)
+        if before and before["p50"] and before["throughput"] and row["throughput"]:
+            line += f"   p50 {(row['p50'] / before['p50'] - 1) * 100:+.0f}% / req/s {(row['throughput'] / before['throughput'] - 1) * 100:+.0f}%"
+        print(line)
+    for name, row in rows.items():
+        if row["first_error"]:
+            print(f"\n[{name}] 最初のエラー:\n{row['first_error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", default=",".join(TARGETS), help="カンマ区切りのターゲット名")
+    parser.add_argument("--requests", type=int, default=30, help="ターゲットごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="測定前に実行する回数（集計しない）")
+    parser.add_argument("--warm", action="store_true", help="同じURL・クエリを繰り返す（キャッシュに当たる場合）")
+    parser.add_argument("--corpus", help="*.html を置いたディレクトリ（省略時は合成ページ）")
+    parser.add_argument("--page-kb", type=int, default=50, help="合成ページの大きさ")
+    parser.add_argument("--latency-ms", type=float, default=50, help="HTTPサーバーの応答の待ち時間")
+    parser.add_argument("--search-ms", type=float, default=200, help="DDGSの代役の待ち時間")
+    parser.add_argument("--search-results", type=int, default=5)
+    parser.add_argument("--llm-ms", type=float, default=300, help="チャットモデルの最初の応答までの待ち時間")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="チャットモデルのストリーミング速度")
+    parser.add_argument("--prefetch", action="store_true", help="LangChain Agentで検索結果の上位ページを先読みする")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する以前の結果（--jsonで保存したもの）")
+    args = parser.parse_args(argv)
+
+    names = args.targets.split(",")
+    unknown = set(names) - set(TARGETS)
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown))}")
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))["results"] if args.baseline else None
+
+    with CorpusServer(args.corpus, page_bytes=args.page_kb * 1024, latency_sec=args.latency_ms / 1000) as server:
+        install_fakes(server, args)
+        targets = make_targets(server, args)
+        print(f"requests={args.requests} concurrency={args.concurrency} warm={args.warm} "
+              f"pages={len(server.pages)} cache_dir={os.environ['AGENT_CACHE_DIR']}")
+        rows = {name: run(targets[name](), args.requests, args.concurrency, args.warmup) for name in names}
+
+    print_rows(rows, baseline)
+    if args.prefetch:
+        from tools.prefetch import prefetch_stats
+        stats = prefetch_stats()
+        print(f"\nprefetch: {stats['hits']} / {stats['prefetched']} hits ({stats['hit_ratio']:.0%}), "
+              f"{stats['failed']} failed, {stats['unused']} unused, {stats['cancelled']} cancelled, {stats['wasted_bytes']} bytes wasted")
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps({"config": vars(args), "results": rows}, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+
+if __name__ == "__main__":
+    main()
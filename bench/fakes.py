@@ -0,0 +1,225 @@
+"""ネットワークやAPIキーなしでAgentを動かすためのローカルな代役"""
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def _chunk(parts):
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+
+def text_part(text):
+    return SimpleNamespace(text=text, function_call=None)
+
+
+def call_part(name, **args):
+    return SimpleNamespace(text="", function_call=SimpleNamespace(name=name, args=args))
+
+
+class FakeGeminiModel:
+    """台本どおりに応答するGenerativeModelの代役
+
+    turnsは1ターンごとのパーツのリストです（text_part / call_part）。
+    テキストはchunk_charsずつ、tokens_per_secの速さでストリーミングします。
+    """
+
+    def __init__(self, turns, chunk_chars=8, tokens_per_sec=None):
+        self.turns = list(turns)
+        self.chunk_chars = chunk_chars
+        self.tokens_per_sec = tokens_per_sec
+        self.calls = []
+
+    def generate_content(self, contents, tools=None, stream=False, **kwargs):
+        self.calls.append(contents)
+        parts = self.turns[min(len(self.calls), len(self.turns)) - 1]
+        chunks = list(self._chunks(parts))
+        if not stream:
+            return _chunk([p for c in chunks for p in c.candidates[0].content.parts])
+        return self._stream(chunks)
+
+    def _chunks(self, parts):
+        for part in parts:
+            if part.function_call is not None:
+                yield _chunk([part])
+                continue
+            for i in range(0, len(part.text), self.chunk_chars):
+                yield _chunk([text_part(part.text[i:i + self.chunk_chars])])
+
+    def _stream(self, chunks):
+        for chunk in chunks:
+            if self.tokens_per_sec:
+                time.sleep(1 / self.tokens_per_sec)
+            yield chunk
+
+
+def fake_tool_backends(latency_sec=0.1):
+    """search_web / fetch_page の代役（latency_secだけ待ってから決まった結果を返す）"""
+    def search_web(args):
+        time.sleep(latency_sec)
+        return {"results": [
+            {"title": f"{args['query']} {i}", "snippet": "snippet", "url": f"http://example.test/{i}"}
+            for i in range(3)
+        ]}
+
+    def fetch_page(args):
+        time.sleep(latency_sec)
+        return {"status": 200, "page_content": {"title": args["url"], "content": f"{args['url']} の本文", "has_next": False}}
+
+    return {"search_web": search_web, "fetch_page": fetch_page}
+
+
+def synthetic_page(index, size_bytes):
+    """およそsize_bytesの、記事らしい構造のHTMLを作る"""
+    paragraph = f"<p>ページ{index}の本文です。検索エージェントのベンチマーク用の文章が続きます。</p>\n"
+    body = paragraph * max(1, size_bytes // len(paragraph.encode("utf-8")))
+    return (
+        f"<html><head><meta charset='utf-8'><title>ページ{index}</title></head><body>"
+        f"<nav>メニュー</nav><article><h1>ページ{index}</h1>{body}</article><footer>フッター</footer>"
+        "</body></html>"
+    )
+
+
+class CorpusServer:
+    """HTMLコーパスを返すローカルのHTTPサーバー（withで起動・停止する）
+
+    corpus_dirの *.html を、なければpage_bytesの合成ページをpage_count件返します。
+    パス /page/<番号> の番号でページを選び、クエリ文字列は無視するので、
+    ?r=<番号> を付ければキャッシュに当たらない別のURLとして同じページを取得できます。
+    各レスポンスはlatency_secだけ待ってから返します。
+    """
+
+    def __init__(self, corpus_dir=None, page_count=20, page_bytes=50_000, latency_sec=0.05):
+        if corpus_dir:
+            self.pages = [p.read_bytes() for p in sorted(Path(corpus_dir).glob("*.html"))]
+        else:
+            self.pages = [synthetic_page(i, page_bytes).encode("utf-8") for i in range(page_count)]
+        if not self.pages:
+            raise ValueError(f"No *.html files in {corpus_dir}")
+        self.latency_sec = latency_sec
+        self.requests = 0
+        self._server = None
+
+    def __enter__(self):
+        corpus = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-aliveで接続を使い回せるようにする
+
+            def do_GET(self):
+                corpus.requests += 1
+                time.sleep(corpus.latency_sec)
+                path = urlsplit(self.path).path
+                try:
+                    body = corpus.pages[int(path.rsplit("/", 1)[-1]) % len(corpus.pages)]
+                except ValueError:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, index, request_id=None):
+        host, port = self._server.server_address
+        url = f"http://{host}:{port}/page/{index % len(self.pages)}"
+        return url if request_id is None else f"{url}?r={request_id}"
+
+
+def fake_ddgs(server, results=5, latency_sec=0.2):
+    """duckduckgo_search.DDGSの代役（コーパスサーバーのURLを検索結果として返す）
+
+    tools.search_ddg.DDGS を戻り値のクラスに差し替えて使います。
+    """
+    class FakeDDGS:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def text(self, query, **kwargs):
+            time.sleep(latency_sec)
+            # 同じクエリには同じページを、クエリごとに別のURLで返す
+            digest = hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+            offset = int(digest, 16)
+            for i in range(results):
+                yield {
+                    "title": f"{query} {i}",
+                    "body": f"{query} に関するページ{i}の抜粋",
+                    "href": server.url(offset + i, request_id=f"{digest}-{i}"),
+                }
+
+    return FakeDDGS
+
+
+class FakeChatModel(BaseChatModel):
+    """台本どおりに応答するChatOpenAIの代役
+
+    turnsの各要素はAIMessageか、これまでのメッセージを受け取ってAIMessageを返す関数です。
+    何ターン目か（入力に含まれるAIMessageの数）で使う要素を決めるので、
+    同じインスタンスを複数の会話で並行して使えます。
+    tool_turnsを渡すと、bind_toolsしたモデル（tool calling Agent）はそちらの台本を使います。
+    ストリーミング時はテキストをchunk_charsずつ、tokens_per_secの速さで流します。
+    """
+
+    turns: list
+    tool_turns: list = None
+    chunk_chars: int = 4
+    tokens_per_sec: float = 0
+    latency_sec: float = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        if self.tool_turns is None:
+            return self
+        return self.model_copy(update={"turns": self.tool_turns})
+
+    def _turn(self, messages):
+        index = sum(1 for m in messages if isinstance(m, AIMessage))
+        turn = self.turns[min(index, len(self.turns) - 1)]
+        return turn(messages) if callable(turn) else turn
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_sec)
+        message = self._turn(messages)
+        if self.tokens_per_sec:
+            time.sleep(len(message.content) / self.chunk_chars / self.tokens_per_sec)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_sec)
+        message = self._turn(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]))
+            return
+        for i in range(0, len(message.content), self.chunk_chars):
+            if self.tokens_per_sec:
+                time.sleep(1 / self.tokens_per_sec)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=message.content[i:i + self.chunk_chars]))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,93 @@
+"""Streamlitアプリの起動時間（import時間）のプロファイラ
+
+`python -X importtime` で対象を新しいプロセスとして読み込み、モジュールごとの
+import時間の内訳を表示します。コンテナの起動が遅くなっていないかの確認用です。
+
+    python -m bench.profile_startup app.py --top 20
+    python -m bench.profile_startup core.agents --json
+    python -m bench.profile_startup app.py --budget-ms 1500   # 超えたら終了コード1
+"""
+import re
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+
+ROOT = Path(__file__).resolve().parent.parent
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_importtime(target):
+    """対象（スクリプトのパスまたはモジュール名）を読み込み、-X importtimeの出力を返す"""
+    if target.endswith(".py"):
+        # Streamlitのスクリプトは素のPythonで実行してもトップレベルのimportまでは同じ
+        code = f"import runpy; runpy.run_path({str(ROOT / target)!r}, run_name='__main__')"
+    else:
+        code = f"import {target}"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    return proc.stderr
+
+
+def parse_importtime(output):
+    """モジュールごとの (self_us, cumulative_us, depth) を返す"""
+    modules = {}
+    for line in output.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+def summarize(modules, top):
+    # トップレベルのパッケージごとに自身のimport時間を合計する
+    by_package = defaultdict(int)
+    for name, (self_us, _, _) in modules.items():
+        by_package[name.split(".")[0]] += self_us
+    total_us = sum(self_us for self_us, _, _ in modules.values())
+    return {
+        "total_ms": total_us / 1000,
+        "modules": len(modules),
+        "packages": [
+            {"package": name, "ms": us / 1000}
+            for name, us in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]
+        ],
+        "slowest_imports": [
+            {"module": name, "cumulative_ms": cum / 1000, "self_ms": self_us / 1000}
+            for name, (self_us, cum, _) in sorted(modules.items(), key=lambda kv: -kv[1][1])[:top]
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("target", help="app.py などのスクリプト、または core.agents などのモジュール名")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--budget-ms", type=float, help="合計import時間の上限（超えたら終了コード1）")
+    args = parser.parse_args(argv)
+
+    summary = summarize(parse_importtime(run_importtime(args.target)), args.top)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"{args.target}: {summary['total_ms']:.1f} ms, {summary['modules']} modules")
+        print(f"\n{'package':<30} {'self ms':>10}")
+        for row in summary["packages"]:
+            print(f"{row['package']:<30} {row['ms']:>10.1f}")
+        print(f"\n{'module':<50} {'cumulative ms':>14} {'self ms':>10}")
+        for row in summary["slowest_imports"]:
+            print(f"{row['module']:<50} {row['cumulative_ms']:>14.1f} {row['self_ms']:>10.1f}")
+
+    if args.budget_ms is not None and summary["total_ms"] > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import re
+from core.resources import api_key_fingerprint, get_resource_cache
+
+# networkx・langchain・各ツールは重いので、選ばれたAgentを作るときに初めてimportする
+
+MODEL_NAME = "gpt-3.5-turbo"
+# NetworkX Agentで、言い換えた検索クエリを並行して検索する数（0なら元の質問だけ）
+# AGENT_QUERY_REWRITESで既定の数を変えられる（get_agent(..., query_rewrites=...)で呼び出しごとにも指定できる）
+QUERY_REWRITES = int(os.environ.get("AGENT_QUERY_REWRITES", "0"))
+
+# 「- 」「・」「1. 」「2) 」など、行頭の箇条書きの記号
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-・*]|\d+[.)])\s*")
+
+# System Promptの作成
+CUSTOM_SYSTEM_PROMPT = """
+あなたの役割
+あなたの役割はuserの入力する質問に対して、インターネットでWebページを調査をし、回答することです。
+あなたが従わなければいけないルール
+回答はできるだけ短く、要約して回答してください
+文章が長くなる場合は改行して見やすくしてください
+回答の最後に改行した後、参照したページのURLを記載してください
+"""
+
+# LangChain Agent
+def create_langchain_agent(api_key, model_name=MODEL_NAME, rate_limiter=None):
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+    from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+    from tools.search_ddg import search_ddg
+    from tools.fetch_page import fetch_page
+    from tools.trace_langchain import TraceCallbackHandler
+
+    tools = [search_ddg, fetch_page]
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", CUSTOM_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history", optional=True),
+        ("user", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad")
+    ])
+
+    llm = ChatOpenAI(temperature=0., model_name=model_name, api_key=api_key, rate_limiter=rate_limiter,
+                     stream_usage=True, callbacks=[TraceCallbackHandler()])
+
+    agent = create_tool_calling_agent(llm, tools, prompt)
+
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+    )
+
+# NetworkX based Agent
+def create_networkx_agent(api_key, model_name=MODEL_NAME, query_rewrites=QUERY_REWRITES, rate_limiter=None):
+    """検索 → 取得 → 回答のグラフを実行するAgentを作る
+
+    query_rewritesが1以上なら、LLMで言い換えた検索クエリでも並行して検索し、
+    結果をまとめてから取得します（start → search_0 / rewrite → search_i → merge）。
+    rate_limiterを渡すと、LLMの呼び出しをそのレートに抑えます。
+    """
+    import networkx as nx
+    from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+    from tools.search_ddg import search_ddg
+    from tools.fetch_pages import fetch_pages, FETCH_FAN_OUT, FETCH_DEADLINE_SEC
+    from tools.context_select import select_context
+    from tools.dedup import dedup_results, dedup_pages
+    from tools.chunk_store import get_chunk_store
+    from core.graph_executor import run_graph
+    from tools.trace_langchain import TraceCallbackHandler
+
+    # ストリーミング時もトークン数を受け取り、呼び出しごとにスパンとして記録する
+    llm = ChatOpenAI(temperature=0, model_name=model_name, api_key=api_key, rate_limiter=rate_limiter,
+                     stream_usage=True, callbacks=[TraceCallbackHandler()])
+    answer_prompt = ChatPromptTemplate.from_messages([
+        ("system", CUSTOM_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history", optional=True),
+        ("user", "Based on the following information, answer the user's question: {question}\n\n{context}")
+    ])
+    rewrite_prompt = ChatPromptTemplate.from_messages([
+        ("user", "次の質問をWeb検索するための別の検索クエリを{n}個、1行に1つずつ出力してください。\n質問: {question}")
+    ])
+
+    def rewrite(inputs, question, **params):
+        lines = llm.invoke(rewrite_prompt.format_messages(n=query_rewrites, question=question)).content.splitlines()
+        # 行頭の箇条書きの記号だけを除く（クエリの中の数字や記号はそのまま残す）
+        queries = (_LIST_MARKER_RE.sub("", line).strip() for line in lines)
+        return [query for query in queries if query][:query_rewrites]
+
+    def search(index):
+        def node(inputs, question, **params):
+            if index == 0:
+                return search_ddg.invoke({"query": question})
+            rewrites = inputs["rewrite"]
+            return search_ddg.invoke({"query": rewrites[index - 1]}) if index <= len(rewrites) else []
+        return node
+
+    def merge(inputs, question, **params):
+        # 複数の検索結果を、URLの重複を除いて交互に並べる
+        seen, merged = set(), []
+        result_lists = [inputs[name] for name in sorted(inputs)]
+        for rank in range(max((len(r) for r in result_lists), default=0)):
+            for results in result_lists:
+                if rank < len(results) and results[rank]['url'] not in seen:
+                    seen.add(results[rank]['url'])
+                    merged.append(results[rank])
+        return merged
+
+    def fetch(inputs, question, **params):
+        (data,) = inputs.values()
+        # 転載・ミラーなどほぼ同じ検索結果は取得しない（空いた枠には次の結果が入る）
+        urls = [result['url'] for result in dedup_results(data)]
+        # 検索結果を並行して取得（時間は一番遅いページ程度で済む）
+        return fetch_pages(urls[:FETCH_FAN_OUT], deadline_sec=FETCH_DEADLINE_SEC)
+
+    def answer(inputs, question, on_token=None, history=None, **params):
+        # 取得したページ全体から、質問に関係する部分だけをトークン数の上限まで選んでLLMに渡す
+        store = get_chunk_store()
+        pages = []
+        for page in inputs["fetch"]:
+            stored = store.get(page["url"]) if page["status"] == 200 else None
+            if stored is not None:
+                pages.append({"url": page["url"], "title": stored[0], "content": "\n\n".join(stored[1])})
+        # 取得してみたら本文がほぼ同じだったページは、プロンプトに入れる前に除く
+        pages = dedup_pages(pages)
+        context = select_context(question, pages)
+        # historyは会話の要約と直近のターン（core.conversation.ConversationStore.messages）
+        messages = answer_prompt.format_messages(question=question, context=context, chat_history=history or [])
+        if on_token is None:
+            return llm.invoke(messages)
+        # ストリーミング時は届いたトークンから順に渡す
+        response = None
+        for chunk in llm.stream(messages):
+            if chunk.content:
+                on_token(chunk.content)
+            response = chunk if response is None else response + chunk
+        return response
+
+    G = nx.DiGraph()
+    G.add_node("start")
+    G.add_node("search_0", func=search(0))
+    G.add_node("fetch", func=fetch)
+    G.add_node("answer", func=answer)
+    G.add_edge("start", "search_0")
+    if query_rewrites > 0:
+        G.add_node("rewrite", func=rewrite)
+        G.add_node("merge", func=merge)
+        G.add_edge("start", "rewrite")
+        G.add_edge("search_0", "merge")
+        for index in range(1, query_rewrites + 1):
+            G.add_node(f"search_{index}", func=search(index))
+            G.add_edge("rewrite", f"search_{index}")
+            G.add_edge(f"search_{index}", "merge")
+        G.add_edge("merge", "fetch")
+    else:
+        G.add_edge("search_0", "fetch")
+    G.add_edge("fetch", "answer")
+
+    def run_agent(query, timings=None, on_token=None, on_node_done=None, history=None):
+        run = run_graph(G, query, on_node_done=on_node_done, on_token=on_token, history=history)
+        if timings is not None:
+            timings.update(run.timings)
+        return run.results["answer"]
+
+    return run_agent
+
+
+AGENT_BUILDERS = {
+    "LangChain Agent": create_langchain_agent,
+    "NetworkX Agent": create_networkx_agent,
+}
+
+
+def get_agent(agent_type, api_key, model_name=MODEL_NAME, **options):
+    """(APIキー, モデル, Agentの種類, options) ごとに1回だけ作ったAgentを返す
+
+    optionsはAgentを作る関数にそのまま渡します（例: NetworkX Agentのquery_rewrites）。
+    """
+    builder = AGENT_BUILDERS[agent_type]
+    return get_resource_cache().get_or_build(
+        agent_type,
+        (api_key_fingerprint(api_key), model_name, *sorted(options.items())),
+        lambda: builder(api_key, model_name, **options),
+    )
+
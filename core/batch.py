@@ -0,0 +1,193 @@
+"""JSONLファイルの質問をまとめてAgentで実行するバッチ処理（Streamlitなし）
+
+入力は1行に1つのJSONで、"query"（と任意で"id"）を持ちます。結果は終わった順に
+出力のJSONLへ1行ずつ追記し、出力にすでに成功した結果があるidは飛ばすので、
+中断しても同じコマンドで続きから再開できます。
+
+    python -m core.batch questions.jsonl results.jsonl --agent networkx --concurrency 8
+    python -m core.batch questions.jsonl results.jsonl --llm-rps 2 --search-rps 1
+    python -m core.batch questions.jsonl results.jsonl --agent networkx --query-rewrites 2
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.agents import MODEL_NAME, QUERY_REWRITES, AGENT_BUILDERS
+from tools.resilience import TokenBucket, set_rate_limit, upstream_stats
+from tools.tracing import trace
+from tools.prefetch import prefetch_turn, prefetch_stats
+from tools.dedup import dedup_turn, dedup_stats
+
+AGENT_ALIASES = {"langchain": "LangChain Agent", "networkx": "NetworkX Agent"}
+BATCH_CONCURRENCY = 4
+
+
+def read_queries(path):
+    """入力のJSONLを読み、{"id", "query"} のリストを返す（idがなければ行番号）"""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            queries.append({"id": str(record.get("id", line_no)), "query": record["query"]})
+    return queries
+
+
+def completed_ids(path):
+    """出力のJSONLから、成功した結果のidを集める（途中で切れた最後の行は無視する）"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def _answer_text(result):
+    if isinstance(result, dict):
+        return result["output"]
+    return result.content
+
+
+def run_batch(queries, output_path, agent_type="NetworkX Agent", api_key=None, model_name=MODEL_NAME,
+              concurrency=BATCH_CONCURRENCY, llm_rps=None, search_rps=None, fetch_rps=None, prefetch=None,
+              query_rewrites=None, on_result=None):
+    """質問をconcurrency件ずつ並行してAgentで実行し、結果をoutput_pathに追記する
+
+    llm_rps / search_rps / fetch_rps を指定すると、LLM・DuckDuckGo・ページ取得の
+    1秒あたりの呼び出し回数をすべての実行の合計でその値に抑えます。
+    prefetchがTrueなら、LangChain Agentで検索結果の上位ページを先読みします。
+    query_rewritesを指定すると、NetworkX AgentでLLMが言い換えたその数の検索クエリでも並行して検索します。
+    output_pathにすでに成功した結果があるidは実行しません。
+
+    Returns
+    -------
+    Dict[str, Any]:
+    - total / skipped / ok / error: 件数
+    - wall_sec: 全体の時間
+    - queries_per_sec: 1秒あたりに終わった質問の数
+    - upstreams: 接続先ごとの失敗・リトライ・ブレーカーの状態（tools.resilience.upstream_stats）
+    - prefetch: 先読みのヒット率・無駄になったバイト数（tools.prefetch.prefetch_stats）
+    - dedup: 重複として取得しなかった検索結果・除いたページとトークン数（tools.dedup.dedup_stats）
+    """
+    from core import graph_executor
+    from core.graph_executor import GRAPH_MAX_WORKERS
+
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    # [1] 接続先ごとのレート制限（すべてのスレッドで共有する）
+    if search_rps is not None:
+        set_rate_limit("ddg", search_rps)
+    set_rate_limit("fetch", fetch_rps, burst=max(concurrency, 1))
+    rate_limiter = TokenBucket(llm_rps) if llm_rps else None
+    options = {"rate_limiter": rate_limiter}
+    if agent_type == "NetworkX Agent" and query_rewrites is not None:
+        options["query_rewrites"] = query_rewrites
+    agent = AGENT_BUILDERS[agent_type](api_key, model_name, **options)
+    if hasattr(agent, "verbose"):
+        agent.verbose = False
+    if concurrency > GRAPH_MAX_WORKERS:
+        # 同時に実行するグラフのノードが待たされないようにする
+        graph_executor.configure(max_workers=concurrency)
+
+    # [2] 成功済みの質問は飛ばす（再開）
+    done = completed_ids(output_path)
+    pending = [q for q in queries if q["id"] not in done]
+    stats = {"total": len(queries), "skipped": len(queries) - len(pending), "ok": 0, "error": 0}
+
+    def run_one(item):
+        started = time.perf_counter()
+        record = {"id": item["id"], "query": item["query"], "agent": agent_type}
+        with trace("batch", id=item["id"]) as run_trace:
+            try:
+                if agent_type == "LangChain Agent":
+                    with prefetch_turn(enabled=prefetch), dedup_turn():
+                        result = agent.invoke({"input": item["query"]})
+                else:
+                    result = agent(item["query"])
+                record.update(status="ok", answer=_answer_text(result))
+            except Exception as e:
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+        record["wall_sec"] = time.perf_counter() - started
+        record["steps"] = run_trace.summary()
+        return record
+
+    # [3] 並行して実行し、終わった順に1行ずつ書き出す
+    write_lock = threading.Lock()
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="batch") as executor:
+        futures = [executor.submit(run_one, item) for item in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            stats[record["status"]] += 1
+            if on_result is not None:
+                on_result(record)
+
+    stats["wall_sec"] = time.perf_counter() - started
+    finished = stats["ok"] + stats["error"]
+    stats["queries_per_sec"] = finished / stats["wall_sec"] if stats["wall_sec"] else 0.0
+    stats["upstreams"] = upstream_stats()
+    stats["prefetch"] = prefetch_stats()
+    stats["dedup"] = dedup_stats()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="質問のJSONL（1行に {\"id\": ..., \"query\": ...}）")
+    parser.add_argument("output", help="結果を追記するJSONL（再開時も同じパスを指定）")
+    parser.add_argument("--agent", choices=sorted(AGENT_ALIASES), default="networkx")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--llm-rps", type=float, help="LLMの呼び出し回数の上限（1秒あたり）")
+    parser.add_argument("--search-rps", type=float, help="DuckDuckGoの検索回数の上限（1秒あたり）")
+    parser.add_argument("--fetch-rps", type=float, help="ページ取得回数の上限（1秒あたり）")
+    parser.add_argument("--prefetch", action="store_true", default=None,
+                        help="検索結果の上位ページを先読みする（LangChain Agent）")
+    parser.add_argument("--query-rewrites", type=int, default=QUERY_REWRITES,
+                        help="LLMで言い換えて並行して検索するクエリの数（NetworkX Agent）")
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        parser.error("OPENAI_API_KEY is not set")
+    queries = read_queries(args.input)
+
+    def report(record):
+        print(f"[{record['status']}] {record['id']} ({record['wall_sec']:.1f}秒) {record['query']}", flush=True)
+
+    stats = run_batch(
+        queries, args.output, agent_type=AGENT_ALIASES[args.agent], model_name=args.model,
+        concurrency=args.concurrency, llm_rps=args.llm_rps, search_rps=args.search_rps,
+        fetch_rps=args.fetch_rps, prefetch=args.prefetch,
+        query_rewrites=args.query_rewrites, on_result=report,
+    )
+    print(f"{stats['ok']} ok / {stats['error']} error / {stats['skipped']} skipped, "
+          f"{stats['wall_sec']:.1f}秒, {stats['queries_per_sec']:.2f} 件/秒")
+    for name, upstream in sorted(stats["upstreams"].items()):
+        if upstream["failures"] or upstream["rejected"] or upstream["state"] != "closed":
+            print(f"  {name}: {upstream['failures']} failures / {upstream['retries']} retries / "
+                  f"{upstream['rejected']} rejected ({upstream['state']})")
+    if stats["prefetch"]["prefetched"]:
+        prefetch = stats["prefetch"]
+        print(f"prefetch: {prefetch['hits']} / {prefetch['prefetched']} hits ({prefetch['hit_ratio']:.0%}), "
+              f"{prefetch['wasted_bytes']} bytes wasted")
+    if any(stats["dedup"].values()):
+        dedup = stats["dedup"]
+        print(f"dedup: {dedup['fetches_avoided']} fetches avoided, {dedup['pages_dropped']} pages dropped, "
+              f"{dedup['tokens_avoided']} tokens avoided")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tools.context_select import get_encoding, truncate_tokens
+from tools.tracing import span, in_context
+
+# そのまま保持する直近のターン数と、プロンプトに入れる1ターン・要約のトークン数の上限
+RECENT_TURNS = 6
+TURN_TOKEN_BUDGET = 500
+SUMMARY_TOKEN_BUDGET = 400
+# 要約（コンパクション）を実行するバックグラウンドのスレッド数
+COMPACT_MAX_WORKERS = 2
+
+_ROLE_NAMES = {"user": "ユーザー", "assistant": "アシスタント"}
+_MESSAGE_ROLES = {"user": "human", "assistant": "ai"}
+
+SUMMARY_PROMPT = """以下は、これまでの会話の要約と、その後に続いた会話です。
+この後の質問に答えるために必要な情報（話題、固有名詞、ユーザーの関心、出した結論）が残るように、
+{token_budget}トークン以内の1つの要約にまとめてください。要約だけを出力してください。
+
+# これまでの要約
+{summary}
+
+# その後の会話
+{turns}"""
+
+_pool = None
+_pool_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=COMPACT_MAX_WORKERS, thread_name_prefix="compact")
+    return _pool
+
+
+def _keep_tail(text, max_tokens):
+    """末尾からmax_tokensトークン分だけを残す（新しい内容を優先する）"""
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:])
+
+
+def format_turns(turns, turn_token_budget=TURN_TOKEN_BUDGET):
+    return "\n".join(
+        f"{_ROLE_NAMES.get(t['role'], t['role'])}: {truncate_tokens(t['content'], turn_token_budget)}"
+        for t in turns
+    )
+
+
+def extractive_summary(summary, turns, token_budget):
+    """LLMを使わない要約（各ターンの冒頭を並べ、新しい方からtoken_budgetに収める）"""
+    text = "\n".join(filter(None, [summary, format_turns(turns, turn_token_budget=60)]))
+    return _keep_tail(text, token_budget)
+
+
+class ConversationStore:
+    """1セッション分の会話を、一定のメモリとプロンプトの大きさで保持する
+
+    直近のmax_turnsターンだけをリングバッファにそのまま残し、あふれた古いターンは
+    バックグラウンドでsummarize(summary, turns, token_budget)により要約へまとめます。
+    要約はsummary_token_budgetトークン以下に切り詰めるので、会話が長くなっても
+    保持する量とプロンプトに入れる量は増えません。
+    """
+
+    def __init__(self, max_turns=RECENT_TURNS, summary_token_budget=SUMMARY_TOKEN_BUDGET,
+                 turn_token_budget=TURN_TOKEN_BUDGET, summarize=None):
+        self.max_turns = max_turns
+        self.summary_token_budget = summary_token_budget
+        self.turn_token_budget = turn_token_budget
+        self.summarize = summarize or extractive_summary
+        self.summary = ""
+        self.total_turns = 0
+        self._turns = deque()
+        self._pending = []  # 要約待ちの古いターン
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def append(self, role, content, **extra):
+        """ターンを追加する（roleは "user" / "assistant"）"""
+        with self._lock:
+            self._turns.append({"role": role, "content": content, **extra})
+            self.total_turns += 1
+            while len(self._turns) > self.max_turns:
+                self._pending.append(self._turns.popleft())
+            start = bool(self._pending) and not self._compacting
+            if start:
+                self._compacting = True
+        if start:
+            # 要約のスパンが、このターンのトレースに入るようにする
+            _get_pool().submit(in_context(self._compact))
+
+    def _compact(self):
+        # 空になったのを確かめたときは、同じロックの中で_compactingを戻す
+        # （直後のappendが始めた次の要約を、finallyで取り消さないようにする）
+        finished = False
+        try:
+            while True:
+                with self._lock:
+                    batch, summary = list(self._pending), self.summary
+                    if not batch:
+                        self._compacting = False
+                        finished = True
+                        return
+                with span("conversation.compact", "llm", turns=len(batch)):
+                    try:
+                        new_summary = self.summarize(summary, batch, self.summary_token_budget)
+                    except Exception:
+                        new_summary = extractive_summary(summary, batch, self.summary_token_budget)
+                with self._lock:
+                    # 上限を超えた場合は、新しく要約したターンが残るよう末尾を残す
+                    self.summary = _keep_tail(new_summary.strip(), self.summary_token_budget)
+                    del self._pending[:len(batch)]
+        except Exception:
+            logger.exception("Conversation compaction failed")
+        finally:
+            # 失敗しても次のappendで要約をやり直せるようにする（要約待ちのターンはそのまま残る）
+            if not finished:
+                with self._lock:
+                    self._compacting = False
+
+    def recent(self):
+        """表示用に、そのまま残っている直近のターンを返す"""
+        with self._lock:
+            return list(self._turns)
+
+    def is_empty(self):
+        return self.total_turns == 0
+
+    def _context(self):
+        with self._lock:
+            summary, pending, turns = self.summary, list(self._pending), list(self._turns)
+        # 要約が終わっていないターンは、冒頭だけを要約に足しておく
+        if pending:
+            summary = extractive_summary(summary, pending, self.summary_token_budget)
+        return summary, turns
+
+    def messages(self):
+        """LangChainのプロンプト（MessagesPlaceholder）に渡す、要約と直近のターン"""
+        summary, turns = self._context()
+        messages = [("system", f"これまでの会話の要約:\n{summary}")] if summary else []
+        messages += [
+            (_MESSAGE_ROLES.get(t["role"], t["role"]), truncate_tokens(t["content"], self.turn_token_budget))
+            for t in turns
+        ]
+        return messages
+
+    def as_text(self):
+        """テキストのプロンプトに埋め込むための、要約と直近のターン"""
+        summary, turns = self._context()
+        parts = [f"これまでの会話の要約: {summary}"] if summary else []
+        if turns:
+            parts.append(format_turns(turns, self.turn_token_budget))
+        return "\n".join(parts)
+
+    def cache_key(self, query):
+        """回答キャッシュのキー（会話の続きなら、同じ質問でも答えが変わるので文脈も含める）"""
+        context = self.as_text()
+        return f"{context}\n\n{query}" if context else query
+
+
+def get_conversation(session_state, key="conversation", **kwargs):
+    """セッションごとのConversationStoreを返す（なければ作る）"""
+    if key not in session_state:
+        session_state[key] = ConversationStore(**kwargs)
+    return session_state[key]
+
+
+def _summary_prompt(summary, turns, token_budget):
+    return SUMMARY_PROMPT.format(
+        token_budget=token_budget, summary=summary or "（なし）", turns=format_turns(turns)
+    )
+
+
+def openai_summarizer(api_key, model_name):
+    """OpenAIのモデルで古いターンを要約する関数を返す"""
+    from core.resources import api_key_fingerprint, get_resource_cache
+
+    def build():
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(temperature=0, model_name=model_name, api_key=api_key)
+
+    def summarize(summary, turns, token_budget):
+        llm = get_resource_cache().get_or_build("summarizer", (api_key_fingerprint(api_key), model_name), build)
+        return llm.invoke(_summary_prompt(summary, turns, token_budget), max_tokens=token_budget).content
+
+    return summarize
+
+
+def gemini_summarizer(model):
+    """GeminiのGenerativeModelで古いターンを要約する関数を返す"""
+    def summarize(summary, turns, token_budget):
+        return model.generate_content(
+            _summary_prompt(summary, turns, token_budget),
+            generation_config={"max_output_tokens": token_budget},
+        ).text
+
+    return summarize
@@ -0,0 +1,153 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from core.json_stream import JsonStepParser
+from tools.tracing import span, in_context
+
+# ツールループの上限（モデルの呼び出し回数と全体の時間）と、ツールの同時実行数
+MAX_STEPS = 6
+DEADLINE_SEC = 90
+TOOL_MAX_WORKERS = 4
+
+TOOL_DECLARATIONS = [
+    {
+        "name": "search_web",
+        "description": "Web検索を行い、結果を返します。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "検索クエリ"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "fetch_page",
+        "description": "指定されたURLのWebページの内容を取得します。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "url": {"type": "string", "description": "取得するWebページのURL"}
+            },
+            "required": ["url"]
+        }
+    }
+]
+
+
+def default_tool_backends():
+    """実際のtools/search_ddg.py・tools/fetch_page.pyにつないだツールを返す"""
+    from tools.search_ddg import search_ddg
+    from tools.fetch_page import fetch_page
+    return {
+        "search_web": lambda args: {"results": search_ddg.func(args["query"])},
+        "fetch_page": lambda args: fetch_page.func(args["url"]),
+    }
+
+
+def _parts(chunk):
+    candidates = getattr(chunk, "candidates", None)
+    if not candidates:
+        return []
+    return candidates[0].content.parts
+
+
+def usage_attrs(chunk):
+    """ストリームの最後のチャンクから、スパンに記録するトークン数を取り出す"""
+    usage = getattr(chunk, "usage_metadata", None)
+    if not usage:
+        return {}
+    return {"prompt_tokens": usage.prompt_token_count, "completion_tokens": usage.candidates_token_count}
+
+
+def _run_tools(calls, backends, deadline):
+    """1ターン分のツール呼び出しを並行して実行し、呼び出しと同じ順で結果を返す"""
+    def call(name, args):
+        backend = backends.get(name)
+        if backend is None:
+            return {"error": f"未知のツールが呼び出されました: {name}"}
+        try:
+            return backend(args)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(TOOL_MAX_WORKERS, len(calls))))
+    try:
+        futures = [executor.submit(in_context(call), name, args) for name, args in calls]
+        wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [
+        future.result() if future.done() else {"error": "制限時間内にツールが終わりませんでした。"}
+        for future in futures
+    ]
+
+
+def run_tool_loop(model, prompt, backends=None, max_steps=MAX_STEPS, deadline_sec=DEADLINE_SEC, on_event=None):
+    """Geminiのfunction callingでツールを繰り返し呼び出し、最終的な回答を返す
+
+    1ターンで複数のツールが呼ばれた場合は並行して実行し、結果をまとめてモデルに返します。
+    ステップ数か時間の上限に達したら、そこまでの内容で打ち切ります。
+
+    on_event(kind, payload) には次のイベントが届きます。
+    - ("field", (key, value)): 応答中のJSONのフィールドが確定した
+    - ("step", dict): 応答中のJSONのステップが確定した
+    - ("tool_call", {"name", "args"}) / ("tool_result", {"name", "args", "result"})
+
+    Returns
+    -------
+    Dict[str, Any]:
+    - text: 最後のターンのテキスト
+    - steps: JSONの推論ステップのリスト
+    - tool_calls: 実行したツール呼び出しの数
+    - stopped: 上限で打ち切った場合はその理由（"max_steps" / "deadline"）
+    """
+    backends = default_tool_backends() if backends is None else backends
+    emit = on_event or (lambda kind, payload: None)
+    deadline = time.monotonic() + deadline_sec
+    contents = [{"role": "user", "parts": [{"text": prompt}]}]
+    steps, tool_calls, text = [], 0, ""
+
+    for _ in range(max_steps):
+        if time.monotonic() >= deadline:
+            return {"text": text, "steps": steps, "tool_calls": tool_calls, "stopped": "deadline"}
+
+        # [1] モデルの応答をストリーミングで受け取り、テキストと関数呼び出しに分ける
+        parser = JsonStepParser()
+        texts, calls = [], []
+        with span("llm", "llm", model=getattr(model, "model_name", None)) as llm_span:
+            chunk = None
+            for chunk in model.generate_content(contents, tools=TOOL_DECLARATIONS, stream=True):
+                if "ttft_sec" not in llm_span.attrs:
+                    llm_span.set(ttft_sec=llm_span.elapsed())
+                for part in _parts(chunk):
+                    function_call = getattr(part, "function_call", None)
+                    if function_call and function_call.name:
+                        calls.append((function_call.name, dict(function_call.args.items())))
+                    elif part.text:
+                        texts.append(part.text)
+                        for event in parser.feed(part.text):
+                            emit(event[0], event[1:] if event[0] == "field" else event[1])
+                            if event[0] == "step":
+                                steps.append(event[1])
+            llm_span.set(tool_calls=len(calls), **usage_attrs(chunk))
+        text = "".join(texts)
+
+        # [2] ツールの呼び出しがなければ、これが最終的な回答
+        if not calls:
+            return {"text": text, "steps": steps, "tool_calls": tool_calls, "stopped": None}
+
+        # [3] ツールを並行して実行し、結果をモデルに返す
+        for name, args in calls:
+            emit("tool_call", {"name": name, "args": args})
+        results = _run_tools(calls, backends, deadline)
+        tool_calls += len(calls)
+        model_parts = [{"text": text}] if text else []
+        model_parts += [{"function_call": {"name": name, "args": args}} for name, args in calls]
+        response_parts = []
+        for (name, args), result in zip(calls, results):
+            emit("tool_result", {"name": name, "args": args, "result": result})
+            response_parts.append({"function_response": {"name": name, "response": {"result": result}}})
+        contents.append({"role": "model", "parts": model_parts})
+        contents.append({"role": "user", "parts": response_parts})
+
+    return {"text": text, "steps": steps, "tool_calls": tool_calls, "stopped": "max_steps"}
@@ -0,0 +1,83 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import networkx as nx
+from tools.tracing import span, in_context
+
+# ノードを実行するワーカースレッドの数
+GRAPH_MAX_WORKERS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(max_workers=GRAPH_MAX_WORKERS):
+    """ノードを実行するワーカースレッドの数を変える（実行中のノードはそのまま終わる）"""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="graph")
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=GRAPH_MAX_WORKERS, thread_name_prefix="graph")
+    return _pool
+
+
+class GraphRun:
+    """グラフ1回分の実行結果
+
+    results: ノード名 -> 戻り値
+    timings: ノード名 -> {"queue_sec": 待ち時間, "wall_sec": 実行時間}
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.timings = {}
+        self.wall_sec = 0.0
+
+
+def run_graph(G, query, on_node_done=None, **params):
+    """DiGraphをトポロジカルな世代ごとに実行する
+
+    各ノードの属性 "func" に func(inputs, query, **params) を登録しておきます。
+    inputsは {前のノード名: 戻り値} で、入力辺のないノードには {} が渡ります。
+    paramsには実行ごとの設定（ストリーミング用のコールバックなど）を渡せます。
+    funcのないノード（"start"など）はqueryをそのまま次へ渡します。
+    同じ世代のノードは互いに依存しないので、ワーカースレッドで同時に実行します。
+    on_node_doneを渡すと、ノードが終わるたびにワーカースレッドから
+    on_node_done(node, timing) が呼ばれます。
+    各ノードはスパンとして記録され、ノード内のツール呼び出しなどはその子になります。
+    """
+    run = GraphRun()
+    start = time.perf_counter()
+    pool = _get_pool()
+
+    def execute(node, submitted_at):
+        started_at = time.perf_counter()
+        func = G.nodes[node].get("func")
+        inputs = {pred: run.results[pred] for pred in G.predecessors(node)}
+        with span(node, "node"):
+            result = query if func is None else func(inputs, query, **params)
+        finished_at = time.perf_counter()
+        run.timings[node] = {
+            "queue_sec": started_at - submitted_at,
+            "wall_sec": finished_at - started_at,
+        }
+        if on_node_done is not None:
+            on_node_done(node, run.timings[node])
+        return result
+
+    for generation in nx.topological_generations(G):
+        # [1] 同じ世代のノードをまとめて投入し、[2] 全部終わるのを待ってから次の世代へ
+        futures = {node: pool.submit(in_context(execute), node, time.perf_counter()) for node in generation}
+        for node, future in futures.items():
+            run.results[node] = future.result()
+
+    run.wall_sec = time.perf_counter() - start
+    return run
@@ -0,0 +1,129 @@
+import re
+import json
+
+# 文字列の外で意味を持つ文字（これ以外は読み飛ばす）
+_STRUCTURAL_RE = re.compile(r'["{}\[\],]')
+_STRING_RE = re.compile(r'["\\]')
+
+
+class JsonStepParser:
+    """ストリーミングで届くJSONオブジェクトを逐次パースする
+
+    ```json のフェンスや前後の文章など、オブジェクトの外にあるテキストは読み飛ばし、
+    連続する複数のオブジェクト（推論の各ステップ）を順に取り出します。
+    トップレベルのフィールド（"思考" など）は値が閉じた時点で返すので、
+    ステップ全体が届く前に表示を更新できます。
+
+    各文字は1回だけ走査し、各フィールド・各オブジェクトも1回だけjson.loadsするので、
+    処理量はストリームの長さに比例します。
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_parts = []
+        self._field_parts = []
+        self._fields = {}
+
+    def feed(self, text):
+        """テキストを追加し、新たに確定したイベントのリストを返す
+
+        Returns
+        -------
+        List[Tuple]:
+        - ("field", key, value): トップレベルのフィールドが確定した
+        - ("step", dict): オブジェクト全体が確定した
+        """
+        events = []
+        pos, end = 0, len(text)
+        while pos < end:
+            # [1] オブジェクトの外: 次の "{" まで読み飛ばす
+            if self._depth == 0:
+                start = text.find("{", pos)
+                if start < 0:
+                    break
+                self._depth = 1
+                self._object_parts = ["{"]
+                self._field_parts = []
+                self._fields = {}
+                pos = start + 1
+                continue
+
+            # [2] 文字列の中: 閉じる " かエスケープまで進める
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._append(text[pos])
+                    pos += 1
+                    continue
+                match = _STRING_RE.search(text, pos)
+                if match is None:
+                    self._append(text[pos:])
+                    break
+                self._append(text[pos:match.end()])
+                pos = match.end()
+                if match.group() == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                continue
+
+            # [3] オブジェクトの中: 構造を表す文字まで進める
+            match = _STRUCTURAL_RE.search(text, pos)
+            if match is None:
+                self._append(text[pos:])
+                break
+            ch = match.group()
+            self._append(text[pos:match.start()])
+            pos = match.end()
+            if ch == '"':
+                self._in_string = True
+                self._append(ch)
+            elif ch in "{[":
+                self._depth += 1
+                self._append(ch)
+            elif ch == "," and self._depth == 1:
+                self._object_parts.append(ch)
+                self._close_field(events)
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._close_field(events)
+                    self._object_parts.append(ch)
+                    self._close_object(events)
+                else:
+                    self._append(ch)
+            else:
+                self._append(ch)
+        return events
+
+    def _append(self, s):
+        if s:
+            self._object_parts.append(s)
+            self._field_parts.append(s)
+
+    def _close_field(self, events):
+        field = "".join(self._field_parts).strip()
+        self._field_parts = []
+        if not field:
+            return
+        try:
+            parsed = json.loads("{" + field + "}")
+        except json.JSONDecodeError:
+            return
+        for key, value in parsed.items():
+            self._fields[key] = value
+            events.append(("field", key, value))
+
+    def _close_object(self, events):
+        text = "".join(self._object_parts)
+        self._object_parts = []
+        try:
+            step = json.loads(text)
+        except json.JSONDecodeError:
+            # 壊れたオブジェクトでも、確定したフィールドだけは使う
+            step = self._fields
+        if step:
+            events.append(("step", step))
+        self._fields = {}
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from tools.page_cache import CACHE_DIR
+from tools.search_cache import normalize_query
+
+# 回答キャッシュの有効期限・メモリ上の件数上限
+LLM_CACHE_TTL_SEC = 24 * 60 * 60
+LLM_CACHE_MAX_ENTRIES = 1000
+# 1にすると、埋め込みベクトルの類似度でほぼ同じ質問の回答も使い回す
+LLM_CACHE_SEMANTIC = os.environ.get("AGENT_LLM_CACHE_SEMANTIC", "0") == "1"
+SIMILARITY_THRESHOLD = 0.95
+REPLAY_CHUNK_CHARS = 24
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """OpenAI・Geminiの回答キャッシュ（メモリのLRU + SQLite）
+
+    (モデル, システムプロンプトのハッシュ, 正規化した入力) が完全に一致すれば
+    そのまま返し、embedを渡した場合は同じモデル・システムプロンプトの中で
+    埋め込みのコサイン類似度がしきい値以上の回答も返します。
+    """
+
+    def __init__(self, path=None, ttl_sec=LLM_CACHE_TTL_SEC, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 similarity_threshold=SIMILARITY_THRESHOLD):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (scope, expires_at, response, embedding)
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, scope TEXT, expires_at REAL, response TEXT, embedding TEXT)"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT key, scope, expires_at, response, embedding FROM responses "
+            "WHERE expires_at > ? ORDER BY expires_at DESC LIMIT ?", (time.time(), self.max_entries)
+        ).fetchall()
+        for key, scope, expires_at, response, embedding in reversed(rows):
+            self._entries[key] = (scope, expires_at, response, json.loads(embedding) if embedding else None)
+
+    @staticmethod
+    def _keys(model, system_prompt, user_input):
+        scope = f"{model}:{_hash(system_prompt)}"
+        return scope, _hash(f"{scope}:{normalize_query(user_input)}")
+
+    def get(self, model, system_prompt, user_input, embed=None):
+        """キャッシュした回答を返す（なければNone）"""
+        scope, key = self._keys(model, system_prompt, user_input)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry[2]
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if e[0] == scope and e[1] > now and e[3] is not None
+            ] if embed is not None else []
+
+        # 埋め込みの類似度で、ほぼ同じ質問の回答を探す
+        if candidates:
+            match = self._most_similar(embed(normalize_query(user_input)), candidates)
+            if match is not None:
+                with self._lock:
+                    self._stats["semantic_hits"] += 1
+                return match
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _most_similar(self, vector, candidates):
+        import numpy as np
+        matrix = np.array([e[3] for _, e in candidates], dtype=np.float32)
+        query = np.asarray(vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        similarities = matrix @ query / np.where(norms == 0, 1.0, norms)
+        best = int(similarities.argmax())
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return candidates[best][1][2]
+
+    def put(self, model, system_prompt, user_input, response, embed=None):
+        scope, key = self._keys(model, system_prompt, user_input)
+        embedding = list(map(float, embed(normalize_query(user_input)))) if embed is not None else None
+        expires_at = time.time() + self.ttl_sec
+        with self._lock:
+            self._entries[key] = (scope, expires_at, response, embedding)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append((self._entries.popitem(last=False)[0],))
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, scope, expires_at, response, json.dumps(embedding) if embedding else None)
+                )
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def replay_chunks(text, chunk_chars=REPLAY_CHUNK_CHARS):
+    """キャッシュした回答を、ストリーミングと同じ表示処理に流すためのチャンクに分ける"""
+    for i in range(0, len(text), chunk_chars):
+        yield text[i:i + chunk_chars]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """プロセス全体で共有するResponseCacheを返す"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                _cache = ResponseCache(path=os.path.join(CACHE_DIR, "llm.sqlite3"))
+    return _cache
+
+
+def openai_embedder(api_key):
+    """LLM_CACHE_SEMANTICが有効なら、OpenAIの埋め込み関数を返す"""
+    if not LLM_CACHE_SEMANTIC:
+        return None
+    from langchain_openai import OpenAIEmbeddings
+    # getとputで同じ質問を2回埋め込まないようにする
+    return lru_cache(maxsize=256)(OpenAIEmbeddings(api_key=api_key).embed_query)
+
+
+def gemini_embedder():
+    """LLM_CACHE_SEMANTICが有効なら、Geminiの埋め込み関数を返す（genai.configure済みであること）"""
+    if not LLM_CACHE_SEMANTIC:
+        return None
+    import google.generativeai as genai
+    return lru_cache(maxsize=256)(
+        lambda text: genai.embed_content(model="models/text-embedding-004", content=text)["embedding"]
+    )
@@ -0,0 +1,61 @@
+import time
+
+# 再描画の間隔（ミリ秒）と、間隔に関係なく再描画する未描画の文字数
+RENDER_INTERVAL_MS = 100
+RENDER_MIN_CHARS = 400
+
+
+class ThrottledRenderer:
+    """ストリーミングの応答をまとめてから描画するためのスケジューラ
+
+    チャンクごとにplaceholder.markdownで全文を送り直すと、送信量が応答の長さの
+    二乗で増えます。届いたチャンクはリストに溜め、前回の描画から
+    interval_ms経過したか、未描画の文字がmin_chars溜まったときだけ描画します。
+    """
+
+    def __init__(self, placeholder, interval_ms=RENDER_INTERVAL_MS, min_chars=RENDER_MIN_CHARS, cursor="▌"):
+        self.placeholder = placeholder
+        self.interval_sec = interval_ms / 1000
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self._text = ""
+        self._pending = []
+        self._pending_chars = 0
+        self._last_render = time.monotonic()
+        self.renders = 0
+        self.bytes_sent = 0
+        self.chunks = 0
+
+    def write(self, chunk):
+        """チャンクを追加し、必要なときだけ描画する"""
+        if not chunk:
+            return
+        self.chunks += 1
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if (self._pending_chars >= self.min_chars
+                or time.monotonic() - self._last_render >= self.interval_sec):
+            self.flush()
+
+    def flush(self, final=False):
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+        body = self._text if final else self._text + self.cursor
+        self.placeholder.markdown(body)
+        self.renders += 1
+        self.bytes_sent += len(body.encode("utf-8"))
+        self._last_render = time.monotonic()
+
+    def close(self):
+        """カーソルなしで最後の描画をして、全文を返す"""
+        self.flush(final=True)
+        return self._text
+
+    @property
+    def text(self):
+        return self._text + "".join(self._pending)
+
+    def stats(self):
+        return {"chunks": self.chunks, "renders": self.renders, "bytes_sent": self.bytes_sent}
@@ -0,0 +1,85 @@
+import time
+import hashlib
+import threading
+
+
+def api_key_fingerprint(api_key):
+    """APIキーをそのまま保持しないためのフィンガープリント"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.built = False
+        self.build_sec = 0.0
+        self.hits = 0
+
+
+class ResourceCache:
+    """LLMクライアントやAgentなど、作るのに時間がかかるオブジェクトのキャッシュ
+
+    Streamlitの再実行やセッションをまたいで (種類, キー) ごとに1回だけ作り、
+    作成にかかった時間から、使い回しで節約できた時間を集計します。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get_or_build(self, kind, key, builder):
+        """(kind, key) のオブジェクトを返す。まだなければbuilder()で作る"""
+        with self._lock:
+            entry = self._entries.setdefault((kind, key), _Entry())
+        # 同じオブジェクトを複数のセッションが同時に作らないようにする
+        with entry.lock:
+            if entry.built:
+                entry.hits += 1
+                return entry.value
+            start = time.perf_counter()
+            entry.value = builder()
+            entry.build_sec = time.perf_counter() - start
+            entry.built = True
+            return entry.value
+
+    def invalidate(self, kind=None, fingerprint=None):
+        """条件に合うオブジェクトを捨てる（APIキーが変わったときなど）
+
+        keyがタプルの場合、fingerprintはその先頭の要素と比較します。
+        """
+        with self._lock:
+            for cache_key in list(self._entries):
+                entry_kind, key = cache_key
+                if kind is not None and entry_kind != kind:
+                    continue
+                if fingerprint is not None and (key[0] if isinstance(key, tuple) else key) != fingerprint:
+                    continue
+                del self._entries[cache_key]
+
+    def stats(self):
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.built]
+        return {
+            "entries": len(entries),
+            "hits": sum(e.hits for e in entries),
+            "build_sec": sum(e.build_sec for e in entries),
+            "saved_sec": sum(e.hits * e.build_sec for e in entries),
+        }
+
+
+_cache = ResourceCache()
+
+
+def get_resource_cache():
+    """プロセス全体で共有するResourceCacheを返す"""
+    return _cache
+
+
+def use_api_key(session_state, api_key):
+    """APIキーが変わったら、前のキーで作ったオブジェクトを捨てる"""
+    fingerprint = api_key_fingerprint(api_key)
+    previous = session_state.get("api_key_fingerprint")
+    if previous is not None and previous != fingerprint:
+        _cache.invalidate(fingerprint=previous)
+    session_state["api_key_fingerprint"] = fingerprint
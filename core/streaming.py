@@ -0,0 +1,111 @@
+import time
+import queue
+import asyncio
+import threading
+from tools.tracing import in_context
+from tools.prefetch import prefetch_turn
+from tools.dedup import dedup_turn
+
+_DONE = object()
+
+
+class AgentStream:
+    """Agentを別スレッドで実行し、進み具合とトークンを順に受け取るためのイテレータ
+
+    target(emit) を実行し、emit(kind, payload) で送られたイベントを
+    (kind, payload) の形で返します。kindは次のいずれかです。
+    - "token": 最終回答のトークン（文字列）
+    - "tool_start" / "tool_end": ツール呼び出しの開始・終了
+    - "node_done": NetworkX Agentのノードの終了
+
+    反復が終わるとresultにAgentの戻り値が入り、ttft_sec（最初のトークンまでの時間）と
+    total_sec（全体の時間）が記録されます。
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._queue = queue.Queue()
+        self.result = None
+        self.ttft_sec = None
+        self.total_sec = None
+        self._error = None
+
+    def _emit(self, kind, payload):
+        self._queue.put((kind, payload))
+
+    def _run(self):
+        try:
+            self.result = self._target(self._emit)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._queue.put(_DONE)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        threading.Thread(target=in_context(self._run), daemon=True).start()
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            if item[0] == "token" and self.ttft_sec is None:
+                self.ttft_sec = time.perf_counter() - start
+            yield item
+        self.total_sec = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+
+
+def stream_langchain_agent(agent, query, chat_history=None, prefetch=None):
+    """AgentExecutorのイベントストリームから、ツールの進み具合と回答のトークンを流す
+
+    chat_historyには会話の要約と直近のターン（ConversationStore.messages）を渡せます。
+    prefetchがTrueなら、検索結果の上位ページをモデルの応答を待つ間に先読みします
+    （Noneなら既定の設定。tools.prefetch）。
+    """
+    inputs = {"input": query, "chat_history": chat_history or []}
+
+    async def consume(emit):
+        output = None
+        async for event in agent.astream_events(inputs, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    emit("token", content)
+            elif kind == "on_tool_start":
+                emit("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end":
+                emit("tool_end", {"name": event["name"]})
+            elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                output = event["data"].get("output")
+        return output
+
+    def run(emit):
+        with prefetch_turn(enabled=prefetch), dedup_turn():
+            return asyncio.run(consume(emit))
+
+    return AgentStream(run)
+
+
+def stream_networkx_agent(agent, query, timings=None, history=None):
+    """NetworkX Agentのノードの終了と、回答のトークンを流す"""
+    return AgentStream(lambda emit: agent(
+        query,
+        timings=timings,
+        history=history,
+        on_token=lambda token: emit("token", token),
+        on_node_done=lambda node, timing: emit("node_done", {"name": node, **timing}),
+    ))
+
+
+def replay_stream(text):
+    """キャッシュした回答を、Agentのストリームと同じ形で流し直す"""
+    from core.llm_cache import replay_chunks
+
+    def replay(emit):
+        for chunk in replay_chunks(text):
+            emit("token", chunk)
+        return text
+
+    return AgentStream(replay)
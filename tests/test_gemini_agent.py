@@ -0,0 +1,97 @@
+"""core/gemini_agent.py のツールループを、台本どおりに応答するモデルと代役のツールで確かめる"""
+import os
+import time
+
+# テストのスパンを手元のトレースファイルに書き出さない
+os.environ.setdefault("AGENT_TRACE", "0")
+
+from bench.fakes import FakeGeminiModel, call_part, fake_tool_backends, text_part  # noqa: E402
+from core.gemini_agent import run_tool_loop  # noqa: E402
+
+TOOL_LATENCY_SEC = 0.3
+
+
+def _function_responses(contents):
+    return [part["function_response"] for part in contents[-1]["parts"]]
+
+
+def test_calls_in_one_turn_run_concurrently():
+    model = FakeGeminiModel([
+        [
+            call_part("search_web", query="a"),
+            call_part("fetch_page", url="http://example.test/0"),
+            call_part("search_web", query="b"),
+        ],
+        [text_part("回答")],
+    ])
+
+    started = time.perf_counter()
+    result = run_tool_loop(model, "質問", backends=fake_tool_backends(latency_sec=TOOL_LATENCY_SEC))
+    elapsed = time.perf_counter() - started
+
+    assert result["text"] == "回答"
+    assert result["tool_calls"] == 3
+    assert result["stopped"] is None
+    # 3つを順に実行すると0.9秒かかる。並行なら1つ分の時間程度で終わる
+    assert elapsed < TOOL_LATENCY_SEC * 2
+
+
+def test_function_responses_are_returned_in_call_order():
+    # 先に呼ばれたツールほど遅く終わるようにする
+    delays = {"first": 0.3, "second": 0.1, "third": 0.0}
+
+    def echo(args):
+        time.sleep(delays[args["query"]])
+        return args["query"]
+
+    model = FakeGeminiModel([
+        [call_part("search_web", query=name) for name in delays],
+        [text_part("回答")],
+    ])
+    run_tool_loop(model, "質問", backends={"search_web": echo})
+
+    responses = _function_responses(model.calls[1])
+    assert [r["response"]["result"] for r in responses] == ["first", "second", "third"]
+    assert all(r["name"] == "search_web" for r in responses)
+
+
+def test_stops_at_max_steps():
+    # 毎ターンツールを呼び続けるモデル
+    model = FakeGeminiModel([[call_part("search_web", query="a")]])
+    result = run_tool_loop(model, "質問", backends=fake_tool_backends(latency_sec=0), max_steps=3)
+
+    assert result["stopped"] == "max_steps"
+    assert result["tool_calls"] == 3
+    assert len(model.calls) == 3
+
+
+def test_stops_at_deadline():
+    model = FakeGeminiModel([[call_part("search_web", query="a")]])
+    started = time.perf_counter()
+    result = run_tool_loop(
+        model, "質問", backends=fake_tool_backends(latency_sec=TOOL_LATENCY_SEC), deadline_sec=0.1
+    )
+
+    assert result["stopped"] == "deadline"
+    assert len(model.calls) == 1
+    # 締め切りを過ぎたツールの終わりは待たない
+    assert time.perf_counter() - started < TOOL_LATENCY_SEC
+
+
+def test_tool_exception_becomes_error_result():
+    def broken(args):
+        raise ValueError("boom")
+
+    events = []
+    model = FakeGeminiModel([
+        [call_part("fetch_page", url="http://example.test/0")],
+        [text_part("回答")],
+    ])
+    result = run_tool_loop(
+        model, "質問", backends={"fetch_page": broken}, on_event=lambda kind, payload: events.append((kind, payload))
+    )
+
+    assert result["stopped"] is None
+    (response,) = _function_responses(model.calls[1])
+    assert response["response"]["result"] == {"error": "ValueError: boom"}
+    assert [payload["result"] for kind, payload in events if kind == "tool_result"] == [{"error": "ValueError: boom"}]
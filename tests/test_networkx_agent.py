@@ -0,0 +1,62 @@
+"""core/agents.py のNetworkX Agentで、言い換えたクエリを並行して検索する枝を確かめる"""
+import os
+
+# テストのスパンを手元のトレースファイルに書き出さない
+os.environ.setdefault("AGENT_TRACE", "0")
+
+import langchain_openai  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+import tools.context_select  # noqa: E402
+import tools.fetch_pages  # noqa: E402
+import tools.search_ddg  # noqa: E402
+from bench.fakes import FakeChatModel  # noqa: E402
+from core.agents import create_networkx_agent  # noqa: E402
+
+REWRITES = "1. 東京 人口 2024\n\n- GPT-4 性能\n2) iPhone 15\n・余分な4つ目"
+
+
+class FakeSearch:
+    """search_ddgの代役（受け取ったクエリを覚え、クエリごとに別のURLを返す）"""
+
+    def __init__(self):
+        self.queries = []
+
+    def invoke(self, args):
+        query = args["query"]
+        self.queries.append(query)
+        return [{"title": query, "snippet": "", "url": f"http://example.test/{query}/{i}"} for i in range(2)]
+
+
+def _reply(messages):
+    if "別の検索クエリ" in messages[-1].content:
+        return AIMessage(content=REWRITES)
+    return AIMessage(content="回答")
+
+
+def test_rewritten_queries_are_searched_and_merged(monkeypatch):
+    search, fetched = FakeSearch(), []
+
+    def fake_fetch_pages(urls, **kwargs):
+        fetched.extend(urls)
+        return []
+
+    monkeypatch.setattr(langchain_openai, "ChatOpenAI", lambda **kwargs: FakeChatModel(turns=[_reply]))
+    monkeypatch.setattr(tools.search_ddg, "search_ddg", search)
+    monkeypatch.setattr(tools.fetch_pages, "fetch_pages", fake_fetch_pages)
+    monkeypatch.setattr(tools.context_select, "select_context", lambda question, pages: "")
+
+    agent = create_networkx_agent("sk-test", query_rewrites=3)
+    timings = {}
+    result = agent("質問", timings=timings)
+
+    assert result.content == "回答"
+    assert {"rewrite", "search_1", "search_2", "search_3", "merge"} <= set(timings)
+    # 行頭の箇条書きの記号だけが除かれ、クエリの中の数字や記号は残る
+    assert sorted(search.queries) == sorted(["質問", "東京 人口 2024", "GPT-4 性能", "iPhone 15"])
+    # 各検索の1件目から順に、交互に並べて取得する
+    assert fetched[:4] == [
+        "http://example.test/質問/0",
+        "http://example.test/東京 人口 2024/0",
+        "http://example.test/GPT-4 性能/0",
+        "http://example.test/iPhone 15/0",
+    ]
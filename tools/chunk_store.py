@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import OrderedDict
+from tools.page_cache import normalize_url
+
+# 保持するページ数と、全チャンクの合計文字数の上限
+CHUNK_STORE_MAX_PAGES = 128
+CHUNK_STORE_MAX_CHARS = 20 * 1000 * 1000
+
+
+class ChunkStore:
+    """分割済みの本文をURLごとに保持するLRUストア
+
+    2ページ目以降（page_num >= 1）はここから返すので、再取得も再分割もしません。
+    保存した時刻も持っておき、get(max_age_sec=...)で古いものは返さないようにできます。
+    """
+
+    def __init__(self, max_pages=CHUNK_STORE_MAX_PAGES, max_chars=CHUNK_STORE_MAX_CHARS):
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()  # url -> (title, chunks, chars, stored_at)
+        self._chars = 0
+
+    def get(self, url, max_age_sec=None):
+        """(title, chunks) を返す（なければ、またはmax_age_sec秒より前に保存したものならNone）"""
+        key = normalize_url(url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                return None
+            if max_age_sec is not None and time.time() - page[3] >= max_age_sec:
+                return None
+            self._pages.move_to_end(key)
+            return page[0], page[1]
+
+    def put(self, url, title, chunks):
+        key = normalize_url(url)
+        chars = sum(len(chunk) for chunk in chunks)
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._chars -= old[2]
+            self._pages[key] = (title, chunks, chars, time.time())
+            self._chars += chars
+            while len(self._pages) > 1 and (len(self._pages) > self.max_pages or self._chars > self.max_chars):
+                _, (_, _, evicted, _) = self._pages.popitem(last=False)
+                self._chars -= evicted
+
+    def stats(self):
+        with self._lock:
+            return {"pages": len(self._pages), "chars": self._chars}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chunk_store():
+    """プロセス全体で共有するChunkStoreを返す"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChunkStore()
+    return _store
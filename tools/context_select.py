@@ -0,0 +1,181 @@
+import re
+import math
+import hashlib
+import threading
+from functools import lru_cache
+from collections import Counter, OrderedDict
+import tiktoken
+
+# LLMに渡すページ本文のトークン数の上限と、選択する単位（パッセージ）の文字数
+CONTEXT_TOKEN_BUDGET = 1500
+PASSAGE_CHARS = 500
+MODEL_NAME = "gpt-3.5-turbo"
+BM25_K1 = 1.5
+BM25_B = 0.75
+_INDEX_CACHE_SIZE = 256
+
+_WORD_RE = re.compile(r"[0-9a-zA-Z]+|[^\s0-9a-zA-Z]+")
+_ASCII_PUNCT = set("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~")
+
+
+def tokenize(text):
+    """BM25用の単語分割
+
+    英数字は単語単位、日本語などの分かち書きしない文字列は文字bigramにします。
+    """
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word.isascii():
+            if word[0] not in _ASCII_PUNCT:
+                terms.append(word)
+            continue
+        word = "".join(ch for ch in word if ch.isalnum())
+        if len(word) == 1:
+            terms.append(word)
+        terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def split_passages(text, passage_chars=PASSAGE_CHARS):
+    """段落の区切りを優先してpassage_chars程度のパッセージに分ける"""
+    passages, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > passage_chars:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(paragraph[:passage_chars])
+            paragraph = paragraph[passage_chars:]
+        if current and len(current) + len(paragraph) + 2 > passage_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+class BM25Index:
+    """パッセージ集合に対するBM25のインデックス"""
+
+    def __init__(self, passages):
+        self.passages = passages
+        self.term_freqs = [Counter(tokenize(p)) for p in passages]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        doc_freq = Counter()
+        for tf in self.term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(passages)
+        self.idf = {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freq.items()}
+
+    def scores(self, query):
+        terms = set(tokenize(query))
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            scores.append(sum(
+                self.idf[t] * tf[t] * (BM25_K1 + 1) / (tf[t] + norm)
+                for t in terms if t in tf
+            ))
+        return scores
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(passages):
+    """同じパッセージ集合のインデックスは作り直さずに使い回す"""
+    key = hashlib.sha1("\x00".join(passages).encode("utf-8")).hexdigest()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = BM25Index(passages)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > _INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name=MODEL_NAME):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model_name=MODEL_NAME):
+    return len(get_encoding(model_name).encode(text))
+
+
+def truncate_tokens(text, max_tokens, model_name=MODEL_NAME):
+    """先頭からmax_tokensトークン分だけを残す"""
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def select_context(query, pages, token_budget=CONTEXT_TOKEN_BUDGET, model_name=MODEL_NAME):
+    """ページ本文から質問に関係の深い部分を選び、トークン数の上限に収める
+
+    Parameters
+    ----------
+    query: str
+        ユーザーの質問
+    pages: List[Dict[str, str]]
+        url, title, content を持つページのリスト
+
+    Returns
+    -------
+    str: 選んだパッセージを出典ごとにまとめたテキスト（token_budgetトークン以下）
+    """
+    # [1] 全ページをパッセージに分けてBM25で順位付け
+    candidates = []
+    for page_index, page in enumerate(pages):
+        for passage_index, passage in enumerate(split_passages(page.get("content", ""))):
+            candidates.append((page_index, passage_index, passage))
+    if not candidates:
+        return ""
+    scores = get_index([c[2] for c in candidates]).scores(query)
+    ranked = sorted(range(len(candidates)), key=lambda i: (-scores[i], i))
+
+    # [2] スコアの高い順にトークン数の上限まで詰める（出典の見出しの分も数える）
+    encoding = get_encoding(model_name)
+    headers = [f"# {page.get('title', '')} ({page.get('url', '')})".strip() for page in pages]
+    remaining = token_budget
+    selected = []
+    for i in ranked:
+        if remaining <= 0:
+            break
+        page_index, passage_index, passage = candidates[i]
+        overhead = 2  # 区切りの改行分
+        if all(s[0] != page_index for s in selected):
+            overhead += len(encoding.encode(headers[page_index])) + 2
+        cost = len(encoding.encode(passage)) + overhead
+        if cost > remaining:
+            if remaining - overhead < 50:  # 細切れのパッセージは入れない
+                continue
+            passage = truncate_tokens(passage, remaining - overhead, model_name)
+            cost = remaining
+        selected.append((page_index, passage_index, passage))
+        remaining -= cost
+
+    # [3] 出典ごと・本文の順番に並べ直して組み立てる
+    sections = []
+    for page_index in sorted({s[0] for s in selected}):
+        body = "\n\n".join(s[2] for s in sorted(selected) if s[0] == page_index)
+        sections.append(f"{headers[page_index]}\n{body}")
+    context = "\n\n".join(sections)
+
+    # 見出しや区切りの分も含めて厳密に上限へ収める
+    return truncate_tokens(context, token_budget, model_name)
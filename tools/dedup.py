@@ -0,0 +1,202 @@
+import os
+import re
+import heapq
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from tools.page_cache import normalize_url
+from tools.context_select import tokenize, count_tokens
+from tools.tracing import annotate
+
+# AGENT_DEDUP=0で、Agentの1回の実行の中での重複ページの検出を止める
+DEDUP_ENABLED = os.environ.get("AGENT_DEDUP", "1") == "1"
+# 何語（日本語は文字bigram）を1つのシングルにするか、MinHashで残すハッシュの数
+SHINGLE_TERMS = 3
+MINHASH_SIZE = 128
+# この類似度（Jaccard係数の推定値）以上をほぼ同じ内容とみなす
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# タイトル・スニペットのシングルがこれより少ない検索結果は、内容では比べずURLだけで比べる
+MIN_RESULT_SHINGLES = 8
+# 本文のSHA-1ごとに覚えておくfingerprintの数（本文そのものはキーにせず、メモリに残さない）
+_FINGERPRINT_CACHE_SIZE = 512
+
+_HOST_PREFIXES = ("www.", "m.", "amp.")
+_AMP_PARAMS = ("amp", "outputtype")
+_PATH_SUFFIX_RE = re.compile(r"(/amp|/index\.html?)?/*$")
+
+_current_turn = contextvars.ContextVar("dedup_turn", default=None)
+
+_fingerprints = OrderedDict()
+_fingerprints_lock = threading.Lock()
+
+_stats = {"fetches_avoided": 0, "pages_dropped": 0, "tokens_avoided": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**counts):
+    with _stats_lock:
+        for key, n in counts.items():
+            _stats[key] += n
+
+
+def canonical_url(url):
+    """同じ記事を指すURLを同一視するためのキー
+
+    normalize_urlに加えて、http/https、www. / m. / amp.、AMP用のパスとパラメータ、
+    末尾の / と index.html の違いを無視します。
+    """
+    parts = urlsplit(normalize_url(url))
+    host = parts.netloc
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = _PATH_SUFFIX_RE.sub("", parts.path) or "/"
+    query = urlencode([
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in _AMP_PARAMS
+    ])
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def _minhash(text):
+    terms = tokenize(text)
+    if len(terms) < SHINGLE_TERMS:
+        shingles = {" ".join(terms)} if terms else set()
+    else:
+        shingles = {" ".join(terms[i:i + SHINGLE_TERMS]) for i in range(len(terms) - SHINGLE_TERMS + 1)}
+    hashes = (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles)
+    return frozenset(heapq.nsmallest(MINHASH_SIZE, hashes))
+
+
+def fingerprint(text):
+    """本文のMinHash（bottom-k）。シングルのハッシュのうち小さい方からMINHASH_SIZE個"""
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _fingerprints_lock:
+        signature = _fingerprints.get(key)
+        if signature is not None:
+            _fingerprints.move_to_end(key)
+            return signature
+    signature = _minhash(text)
+    with _fingerprints_lock:
+        _fingerprints[key] = signature
+        while len(_fingerprints) > _FINGERPRINT_CACHE_SIZE:
+            _fingerprints.popitem(last=False)
+    return signature
+
+
+def similarity(a, b):
+    """2つのfingerprintからJaccard係数を推定する（短い本文どうしなら正確な値になる）"""
+    if not a or not b:
+        return 0.0
+    union = heapq.nsmallest(MINHASH_SIZE, a | b)
+    return sum(1 for h in union if h in a and h in b) / len(union)
+
+
+def dedup_results(results, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """検索結果から、同じURL（canonical_url）とタイトル・スニペットがほぼ同じものを除く
+
+    取得する前に除くので、除いた件数を取得しなくて済んだ回数として数えます。
+    「Home」だけのタイトルなど短すぎる結果は、別のサイトでも一致してしまうのでURLだけで比べます。
+    """
+    kept, seen_urls, seen_signatures = [], set(), []
+    for result in results:
+        if not result["url"]:
+            kept.append(result)
+            continue
+        key = canonical_url(result["url"])
+        signature = fingerprint(f"{result['title']}\n{result['snippet']}")
+        if len(signature) < MIN_RESULT_SHINGLES:
+            signature = None
+        if key in seen_urls or (
+            signature is not None and any(similarity(signature, seen) >= threshold for seen in seen_signatures)
+        ):
+            continue
+        seen_urls.add(key)
+        if signature is not None:
+            seen_signatures.append(signature)
+        kept.append(result)
+    dropped = len(results) - len(kept)
+    if dropped:
+        _count(fetches_avoided=dropped)
+        annotate(duplicates=dropped)
+    return kept
+
+
+def dedup_pages(pages, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """取得したページ（url, title, content）から、本文がほぼ同じものを除く（先の順位のものを残す）"""
+    kept, seen_urls, seen_signatures = [], set(), []
+    tokens = 0
+    for page in pages:
+        key = canonical_url(page["url"])
+        signature = fingerprint(page["content"])
+        if key in seen_urls or any(similarity(signature, seen) >= threshold for seen in seen_signatures):
+            tokens += count_tokens(page["content"])
+            continue
+        seen_urls.add(key)
+        seen_signatures.append(signature)
+        kept.append(page)
+    if len(kept) < len(pages):
+        _count(pages_dropped=len(pages) - len(kept), tokens_avoided=tokens)
+        annotate(duplicate_pages=len(pages) - len(kept), duplicate_tokens=tokens)
+    return kept
+
+
+class DedupTurn:
+    """Agentの1回の実行の中で取得したページを覚えておき、ほぼ同じ内容のページを見つける"""
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._pages = []  # (canonical_url, url, fingerprint)
+        self._lock = threading.Lock()
+
+    def find_duplicate(self, url, content):
+        """同じ実行の中で取得済みの別のページとほぼ同じ内容なら、そのURLを返す"""
+        key = canonical_url(url)
+        signature = fingerprint(content)
+        with self._lock:
+            for seen_key, seen_url, seen_signature in self._pages:
+                if seen_key == key:
+                    return None  # 同じページの続き（page_num）や質問を変えた取得
+                if similarity(signature, seen_signature) >= self.threshold:
+                    return seen_url
+            self._pages.append((key, url, signature))
+        return None
+
+
+@contextmanager
+def dedup_turn(enabled=None, **kwargs):
+    """Agentの1回の実行を囲み、その間にfetch_pageで取得した重複ページを検出する"""
+    if not (DEDUP_ENABLED if enabled is None else enabled):
+        yield None
+        return
+    turn = DedupTurn(**kwargs)
+    token = _current_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
+
+
+def suspend_dedup_turn():
+    """今のコンテキストでは重複ページを検出しない（先読みのように、モデルに見せない取得で使う）"""
+    _current_turn.set(None)
+
+
+def find_duplicate(url, content):
+    """実行中のターンがあれば、取得済みのほぼ同じページのURLを返す（fetch_pageから呼ぶ）"""
+    turn = _current_turn.get()
+    return turn.find_duplicate(url, content) if turn is not None else None
+
+
+def count_avoided_tokens(tokens):
+    _count(tokens_avoided=tokens)
+    annotate(duplicate_tokens=tokens)
+
+
+def dedup_stats():
+    """重複として除いた検索結果（取得しなくて済んだ回数）・ページ・トークン数"""
+    with _stats_lock:
+        return dict(_stats)
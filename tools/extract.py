@@ -0,0 +1,146 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import html2text
+import lxml.html
+from readability import Document
+
+# 本文抽出のエンジン: "readability" / "lxml" / "auto"（単純なページだけlxmlで抽出）
+EXTRACT_ENGINE = os.environ.get("AGENT_EXTRACT_ENGINE", "readability")
+# 抽出を実行するプロセス数（0ならその場で抽出する）
+EXTRACT_PROCESSES = int(os.environ.get("AGENT_EXTRACT_PROCESSES", min(4, os.cpu_count() or 1)))
+EXTRACT_TIMEOUT_SEC = 30
+
+# lxmlで抽出する際に本文として扱わない要素
+_DROP_TAGS = ("script", "style", "noscript", "template", "iframe", "svg",
+              "nav", "header", "footer", "aside", "form")
+_MAIN_XPATH = "//article | //main | //*[@role='main']"
+
+
+def extract_readability(html):
+    """readabilityでスコアリングして本文を抽出する（従来の方法）"""
+    doc = Document(html)
+    title = doc.title()
+    content = html2text.html2text(doc.summary())
+    return title, content
+
+
+def _main_elements(tree):
+    return tree.xpath(_MAIN_XPATH)
+
+
+def is_simple_page(html):
+    """<article>や<main>で本文が1か所にまとまっているページかどうか"""
+    try:
+        tree = lxml.html.fromstring(html)
+    except (ValueError, lxml.etree.ParserError):
+        return False
+    return len(_main_elements(tree)) == 1
+
+
+def extract_lxml(html):
+    """lxmlだけで本文を抽出する高速版
+
+    readabilityのスコアリングは行わず、<article>/<main>（なければ<body>）から
+    ナビゲーションやスクリプトを取り除いた部分を本文とします。
+    """
+    tree = lxml.html.fromstring(html)
+    title = (tree.findtext(".//title") or "").strip()
+    for element in tree.xpath("|".join(f"//{tag}" for tag in _DROP_TAGS)):
+        if element.getparent() is not None:
+            element.drop_tree()
+    mains = _main_elements(tree)
+    root = mains[0] if mains else tree.find(".//body")
+    if root is None:
+        root = tree
+    content = html2text.html2text(lxml.html.tostring(root, encoding="unicode"))
+    return title, content
+
+
+def extract_auto(html):
+    """単純なページはlxml、それ以外はreadabilityで抽出する"""
+    if is_simple_page(html):
+        return extract_lxml(html)
+    return extract_readability(html)
+
+
+ENGINES = {
+    "readability": extract_readability,
+    "lxml": extract_lxml,
+    "auto": extract_auto,
+}
+
+
+def _extract_inline(html, engine):
+    try:
+        return ENGINES[engine](html)
+    except Exception as e:
+        # lxmlの例外などはプロセス間で受け渡せない（pickleできない）ので、メッセージだけにする
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    pool = _pool
+    if pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Streamlitのスレッドをforkしないようにspawnで起動する
+                _pool = ProcessPoolExecutor(
+                    max_workers=EXTRACT_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+            pool = _pool
+    return pool
+
+
+def _reset_pool(pool, terminate=False):
+    """poolを捨て、次の呼び出しで新しいプールを作る
+
+    terminateがTrueなら、実行中のワーカーも止めます（終わらない抽出がワーカーを塞ぎ続けないように）。
+    別のスレッドがすでに作り直していれば何もしません。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    # ProcessPoolExecutorにはワーカーを止める公開APIがないので、プロセスを直接止める
+    processes = list((getattr(pool, "_processes", None) or {}).values()) if terminate else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def extract(html, engine=None, timeout_sec=EXTRACT_TIMEOUT_SEC):
+    """HTMLから (title, content) を抽出する
+
+    EXTRACT_PROCESSESが1以上ならプロセスプールで実行し、呼び出し元のスレッドと
+    GILを塞がないようにします。プールが壊れた場合はその場で抽出します。
+    抽出に失敗した場合と、timeout_sec以内に終わらなかった場合はRuntimeErrorを投げます。
+    """
+    engine = engine or EXTRACT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown extract engine: {engine}")
+    if EXTRACT_PROCESSES <= 0:
+        return _extract_inline(html, engine)
+    pool = _get_pool()
+    try:
+        return pool.submit(_extract_inline, html, engine).result(timeout=timeout_sec)
+    except (BrokenProcessPool, CancelledError):
+        # プールが壊れたか、別の呼び出しのタイムアウトで作り直されたので、その場で抽出する
+        _reset_pool(pool)
+        return _extract_inline(html, engine)
+    except FutureTimeoutError:
+        # 止まったワーカーがプールを塞ぎ続けないよう、プールごと作り直す
+        # （その場で抽出し直しても同じだけかかるので、諦めて呼び出し元でエラーにする）
+        _reset_pool(pool, terminate=True)
+        raise RuntimeError(f"Extraction did not finish within {timeout_sec} seconds") from None
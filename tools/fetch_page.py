@@ -1,18 +1,34 @@
+import time
 import requests
-import html2text
-from readability import Document
+from urllib.parse import urlsplit
 from langchain_core.tools import tool
 from langchain_core.pydantic_v1 import (BaseModel, Field)
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from tools.http_client import download_html
+from tools.page_cache import get_page_cache
+from tools.extract import extract
+from tools.chunk_store import get_chunk_store
+from tools.context_select import select_context, count_tokens
+from tools.tracing import traced, annotate
+from tools.resilience import throttle, call_upstream, CircuitOpenError
+from tools.prefetch import take_prefetched
+from tools.dedup import find_duplicate, count_avoided_tokens
+
+# 本文を分割する際の1ページあたりの文字数
+CHUNK_SIZE = 1000*3
+# バックオフして再試行するHTTPステータス
+RETRY_STATUSES = (429, 502, 503, 504)
 
 class FetchPageInput(BaseModel):
     """正しく文字列や数字で入ってくるようにする（Validator的な）
     """
     url: str = Field()
-    # page_num: int = Field(0, ge=0) # こちらは簡易的に進めたいので、使用しないことにします
+    page_num: int = Field(0, ge=0)
+    query: str = Field("", description="ユーザーの質問（指定すると質問に関係する部分だけを返します）")
 
 @tool(args_schema=FetchPageInput)
-def fetch_page(url, page_num=0, timeout_sec=10):
+@traced("fetch_page")
+def fetch_page(url, page_num=0, query="", timeout_sec=10):
     """
     ## Toolの説明
     本Toolは指定されたURLのWebページから本文の文章を取得するツールです。
@@ -20,6 +36,8 @@ def fetch_page(url, page_num=0, timeout_sec=10):
     ## Toolの動作方法
     1. userがWebページのURLを入力します
     2. assistantはHTTPレスポンスステータスコードと本文の文章内容をusrに回答します
+    3. 本文が長い場合はhas_nextがTrueになるので、page_numを増やして続きを取得します
+    4. queryにユーザーの質問を入れると、ページ全体から質問に関係する部分だけを返します
 
     ## 戻り値の設定
     Returns
@@ -30,41 +48,147 @@ def fetch_page(url, page_num=0, timeout_sec=10):
       - title: str
       - content: str
       - has_next: bool
+      - page_num: int
+      - total_pages: int
     """
 
-    # [1] requestモジュールで指定URLのＷebページ全体を取得
-    try:
-        response = requests.get(url, timeout=timeout_sec)
-        response.encoding = 'utf-8'
-    except requests.exceptions.Timeout:
-        return {
-            "status": 500,
-            "page_content": {'error_message': 'Could not download page due to Timeout Error. Please try to fetch other pages.'}
-        }
+    # [0] 期限内の分割済みの本文があれば、通信せずにそこから返す（検索直後の先読みが進行中なら終わるまで待つ）
+    # 期限はページキャッシュと同じにし、過ぎたら[1][2]で再検証する
+    annotate(url=url, page_num=page_num)
+    take_prefetched(url, timeout_sec)
+    store = get_chunk_store()
+    cache = get_page_cache()
+    page = store.get(url, max_age_sec=cache.ttl_sec)
+    if page is not None:
+        annotate(cache="chunk_store")
+        return _respond(url, page[0], page[1], page_num, query)
 
-    # [2] HTTPレスポンスステータスコードが200番でないときにはエラーを返す
-    if response.status_code != 200:
-        return {
-            "status": response.status_code,
-            "page_content": {'error_message': 'Could not download page. Please try to fetch other pages.'}
-        }
+    # [1] キャッシュを確認（期限内ならダウンロードも抽出もしない）
+    entry = cache.get(url)
+    if entry is not None and cache.is_fresh(entry):
+        annotate(cache="fresh")
+        cache.hit(entry)
+        title, content = entry["title"], entry["content"]
+    else:
+        # [2] 共有セッション（keep-alive）でストリーミング取得。キャッシュがあれば条件付きGETで再検証
+        # ホストごとのレート制限・リトライ・サーキットブレーカーを通す（接続エラーの再試行はhttp_client側）
+        throttle("fetch")
+        started = time.perf_counter()
+        try:
+            response = call_upstream(
+                f"host:{urlsplit(url).netloc.lower()}",
+                lambda: download_html(url, timeout_sec=timeout_sec, headers=cache.conditional_headers(entry)),
+                retry_if=lambda r: r.status_code in RETRY_STATUSES,
+            )
+        except requests.exceptions.Timeout:
+            return {
+                "status": 500,
+                "page_content": {'error_message': 'Could not download page due to Timeout Error. Please try to fetch other pages.'}
+            }
+        except CircuitOpenError:
+            return {
+                "status": 503,
+                "page_content": {'error_message': 'This site is failing repeatedly and is skipped for now. Please try to fetch other pages.'}
+            }
+        except requests.exceptions.RequestException as e:
+            return {
+                "status": 502,
+                "page_content": {'error_message': f'Could not download page ({type(e).__name__}). Please try to fetch other pages.'}
+            }
+        annotate(download_sec=time.perf_counter() - started, bytes=len(response.content), cache="miss")
+
+        if response.status_code == 304 and entry is not None:
+            # 304 Not Modified: 保存済みの抽出結果をそのまま使う
+            annotate(cache="revalidated")
+            cache.revalidated(entry)
+            title, content = entry["title"], entry["content"]
+
+        # [3] HTTPレスポンスステータスコードが200番でないときにはエラーを返す
+        elif response.status_code != 200:
+            return {
+                "status": response.status_code,
+                "page_content": {'error_message': 'Could not download page. Please try to fetch other pages.'}
+            }
+
+        # HTML以外（PDFや画像など）は本文を読まずにエラーを返す
+        elif response.skipped_reason:
+            return {
+                "status": 415,
+                "page_content": {'error_message': f'Not an HTML page ({response.skipped_reason}). Please try to fetch other pages.'}
+            }
 
-    # [3] 本文取得の処理へ（書籍ではtry-exceptできちんとしていますが、簡易に）
-    doc = Document(response.text)
-    title = doc.title()
-    html_content = doc.summary()
-    content = html2text.html2text(html_content)
+        else:
+            # 本文取得の処理へ（抽出はプロセスプールで実行）
+            started = time.perf_counter()
+            try:
+                title, content = extract(response.text)
+            except RuntimeError as e:
+                annotate(error=str(e))
+                return {
+                    "status": 422,
+                    "page_content": {'error_message': f'Could not extract the text of the page ({e}). Please try to fetch other pages.'}
+                }
+            annotate(extract_sec=time.perf_counter() - started)
+            cache.put(
+                url, response.content, response.encoding,
+                response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                title, content
+            )
 
-    # [4] 本文の冒頭を取得
-    chunk_size = 1000*3  #【chunk_sizeを大きくしておきます】
-    content = content[:chunk_size]
+    # [4] 本文を分割して保存（2ページ目以降はここから返す）
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=0)
+    chunks = text_splitter.split_text(content) or [""]
+    store.put(url, title, chunks)
 
     # [5] return処理
+    return _respond(url, title, chunks, page_num, query)
+
+
+def _respond(url, title, chunks, page_num, query):
+    response = _page_response(url, title, chunks, page_num, query)
+    if page_num != 0 or response["status"] != 200:
+        return response
+    # 同じ実行の中で取得済みの別のページ（転載・ミラー）とほぼ同じなら、本文の代わりにそのURLを返す
+    duplicate_of = find_duplicate(url, "\n\n".join(chunks))
+    if duplicate_of is None:
+        return response
+    page_content = response["page_content"]
+    count_avoided_tokens(count_tokens(page_content["content"]))
+    response["page_content"] = {
+        **page_content,
+        "content": f"This page is nearly identical to {duplicate_of}, which was already fetched. Please use that page or fetch other pages.",
+        "duplicate_of": duplicate_of,
+        "has_next": False,
+    }
+    return response
+
+
+def _page_response(url, title, chunks, page_num, query):
+    if query:
+        # 質問が指定されたら、ページ全体から関係する部分をトークン数の上限まで選ぶ
+        content = select_context(query, [{"url": url, "title": title, "content": "\n\n".join(chunks)}])
+        return {
+            "status": 200,
+            "page_content": {
+                "title": title,
+                "content": content,
+                "has_next": False,
+                "page_num": 0,
+                "total_pages": len(chunks)
+            }
+        }
+    if page_num >= len(chunks):
+        return {
+            "status": 400,
+            "page_content": {'error_message': f'page_num must be less than {len(chunks)}. Please try other pages.'}
+        }
     return {
         "status": 200,
         "page_content": {
             "title": title,
-            "content": content,  # chunks[page_num], を文書分割をやめて、contentにします
-            "has_next": False  # page_num < len(chunks) - 1
+            "content": chunks[page_num],
+            "has_next": page_num < len(chunks) - 1,
+            "page_num": page_num,
+            "total_pages": len(chunks)
         }
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from tools.fetch_page import fetch_page
+from tools.tracing import in_context
+
+# 同時に取得するURL数と、全体の締め切り（秒）
+FETCH_FAN_OUT = 5
+FETCH_DEADLINE_SEC = 15
+
+
+def fetch_pages(urls, max_workers=FETCH_FAN_OUT, deadline_sec=FETCH_DEADLINE_SEC):
+    """複数のURLを並行して取得する
+
+    締め切りまでに取得が終わったページだけを、入力したURLの順番で返します。
+    締め切りに間に合わなかった取得はキャンセルします（実行中のものは
+    各リクエストのタイムアウトで打ち切られます）。
+
+    Returns
+    -------
+    List[Dict[str, Any]]:
+    - url: str
+    - status: int
+    - page_content: Dict[str, Any]
+    """
+    urls = list(dict.fromkeys(u for u in urls if u))  # 空と重複を除く
+    if not urls:
+        return []
+
+    deadline = time.monotonic() + deadline_sec
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    try:
+        # [1] 全URLを一斉に投入（各リクエストのタイムアウトは締め切りまで）
+        futures = {
+            executor.submit(in_context(fetch_page.func), url, timeout_sec=deadline_sec): url
+            for url in urls
+        }
+
+        # [2] 締め切りまで待ち、終わったものだけ回収
+        done, _ = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    finally:
+        # [3] 残りはキャンセルして待たずに戻る
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for future, url in futures.items():
+        if future not in done:
+            continue
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {
+                "status": 500,
+                "page_content": {'error_message': f'Could not download page ({type(e).__name__}). Please try to fetch other pages.'}
+            }
+        results.append({"url": url, **result})
+    return results
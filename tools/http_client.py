@@ -0,0 +1,211 @@
+import re
+import codecs
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# brotliが入っていればbrも受け付ける（urllib3側でデコードされる）
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+# コネクションプールの既定値
+POOL_CONNECTIONS = 32   # 保持するホスト別プールの数
+POOL_MAXSIZE = 8        # ホストあたりの最大同時接続数
+CONNECT_RETRIES = 2     # 接続エラー時のリトライ回数
+BACKOFF_FACTOR = 0.2
+
+# ダウンロードする本文の上限（バイト）と、HTMLとして扱うContent-Type
+MAX_DOWNLOAD_BYTES = 2 * 1024 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+_CHUNK_BYTES = 64 * 1024
+_SNIFF_BYTES = 4096
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+
+_session = None
+_adapter = None
+_lock = threading.Lock()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """プールの再利用状況（hit/miss）を数えるHTTPAdapter
+
+    urllib3のプールが持つnum_requests/num_connectionsを集計します。
+    LRUで捨てられたプールの値も失われないように退避しておきます。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._disposed_requests = 0
+        self._disposed_connections = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._dispose_pool
+
+    def _dispose_pool(self, pool):
+        with self._stats_lock:
+            self._disposed_requests += pool.num_requests
+            self._disposed_connections += pool.num_connections
+        pool.close()
+
+    def stats(self):
+        pools = self.poolmanager.pools
+        with pools.lock:
+            live = list(pools._container.values())
+        with self._stats_lock:
+            num_requests = self._disposed_requests + sum(p.num_requests for p in live)
+            num_connections = self._disposed_connections + sum(p.num_connections for p in live)
+        hits = max(num_requests - num_connections, 0)
+        return {
+            "requests": num_requests,
+            "hits": hits,                # 既存の接続を再利用したリクエスト数
+            "misses": num_connections,   # 新規に接続を張った回数
+            "hit_ratio": hits / num_requests if num_requests else 0.0,
+            "live_pools": len(live),
+        }
+
+
+def _build_session(pool_connections, pool_maxsize, connect_retries, backoff_factor):
+    retry = Retry(
+        total=None,
+        connect=connect_retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    )
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,  # ホストあたりの接続数の上限を守る
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": ACCEPT_ENCODING})
+    return session, adapter
+
+
+def configure(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+              connect_retries=CONNECT_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """共有セッションを指定の設定で作り直す（既存の接続は閉じる）"""
+    global _session, _adapter
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session, _adapter = _build_session(
+            pool_connections, pool_maxsize, connect_retries, backoff_factor
+        )
+    return _session
+
+
+def get_session():
+    """プロセス全体で共有するkeep-aliveなrequests.Sessionを返す"""
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _set_default_session()
+    return _session
+
+
+def _set_default_session():
+    global _session, _adapter
+    _session, _adapter = _build_session(
+        POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_RETRIES, BACKOFF_FACTOR
+    )
+
+
+def pool_stats():
+    """コネクションプールのhit/missカウンタを返す"""
+    if _adapter is None:
+        return {"requests": 0, "hits": 0, "misses": 0, "hit_ratio": 0.0, "live_pools": 0}
+    return _adapter.stats()
+
+
+class Download:
+    """download_htmlの結果
+
+    skipped_reasonが入っている場合は本文を読まずに打ち切っています。
+    """
+
+    def __init__(self, status_code, headers, content=b"", encoding="utf-8",
+                 truncated=False, skipped_reason=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.truncated = truncated
+        self.skipped_reason = skipped_reason
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+
+def _lookup_codec(name):
+    try:
+        return codecs.lookup(name.strip().strip("\"'")).name
+    except (LookupError, AttributeError):
+        return None
+
+
+def detect_charset(headers, head):
+    """ヘッダー → BOM → <meta>の順に文字コードを判定する（なければutf-8）"""
+    content_type = headers.get("Content-Type", "")
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            codec = _lookup_codec(value)
+            if codec:
+                return codec
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    match = _META_CHARSET_RE.search(head[:_SNIFF_BYTES])
+    if match:
+        codec = _lookup_codec(match.group(1).decode("ascii", errors="ignore"))
+        if codec:
+            return codec
+    return "utf-8"
+
+
+def download_html(url, timeout_sec=10, max_bytes=MAX_DOWNLOAD_BYTES, headers=None):
+    """HTMLページを上限バイト数までストリーミングで取得する
+
+    Content-TypeがHTMLでなければ本文を読まずに返し、HTMLでもmax_bytesを
+    超えた分は読まずに接続を閉じます。
+    """
+    with get_session().get(url, timeout=timeout_sec, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            return Download(response.status_code, response.headers)
+
+        # [1] 本文を読む前にContent-Typeを確認
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            return Download(response.status_code, response.headers, skipped_reason=f"content-type: {content_type}")
+
+        # [2] 上限バイト数まで読み込む
+        length = response.headers.get("Content-Length")
+        truncated = bool(length and length.isdigit() and int(length) > max_bytes)
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=_CHUNK_BYTES):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                truncated = True
+                break
+        content = b"".join(chunks)[:max_bytes]
+
+    # [3] 文字コードを判定
+    encoding = detect_charset(response.headers, content[:_SNIFF_BYTES])
+    return Download(response.status_code, response.headers, content, encoding, truncated)
@@ -0,0 +1,170 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# キャッシュの保存先・有効期限・容量上限
+CACHE_DIR = os.environ.get("AGENT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "agent"))
+PAGE_CACHE_TTL_SEC = 60 * 60
+PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# URL正規化の際に落とすトラッキング用パラメータ
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "yclid", "mc_cid", "mc_eid")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    """キャッシュのキーにするためにURLを正規化する
+
+    スキーム・ホストの小文字化、既定ポートとフラグメントの除去、
+    トラッキング用パラメータの除去、クエリの並べ替えを行います。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(_TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class PageCache:
+    """ディスク上（SQLite）のページキャッシュ
+
+    生のレスポンスと抽出済みの {title, content} をURLごとに保存します。
+    期限切れのエントリはETag/Last-Modifiedで再検証し、
+    容量上限を超えたら最後に使われたのが古い順に削除します。
+    """
+
+    def __init__(self, path=None, ttl_sec=PAGE_CACHE_TTL_SEC, max_bytes=PAGE_CACHE_MAX_BYTES):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "pages.sqlite3")
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                raw BLOB,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                title TEXT,
+                content TEXT,
+                size INTEGER,
+                fetched_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self._conn.commit()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0, "bytes_saved": 0}
+
+    def get(self, url):
+        """エントリを返す（なければNone）。期限切れでも返すのでis_freshで確認すること"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, raw, encoding, etag, last_modified, title, content, size, fetched_at "
+                "FROM pages WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("url", "raw", "encoding", "etag", "last_modified", "title", "content", "size", "fetched_at")
+        return dict(zip(keys, row))
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl_sec
+
+    @staticmethod
+    def conditional_headers(entry):
+        """再検証（条件付きGET）用のヘッダーを作る"""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def hit(self, entry):
+        """期限内のエントリを使ったことを記録する"""
+        self._touch(entry["url"], refresh=False)
+        with self._lock:
+            self._stats["hits"] += 1
+            self._stats["bytes_saved"] += entry["size"]
+
+    def revalidated(self, entry):
+        """304 Not Modifiedでエントリを使い回したことを記録し、期限を延ばす"""
+        self._touch(entry["url"], refresh=True)
+        with self._lock:
+            self._stats["revalidated"] += 1
+            self._stats["bytes_saved"] += entry["size"]
+
+    def put(self, url, raw, encoding, etag, last_modified, title, content):
+        """取得・抽出した結果を保存する"""
+        now = time.time()
+        size = len(raw) + len(content.encode("utf-8"))
+        with self._lock:
+            self._stats["misses"] += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), raw, encoding, etag, last_modified, title, content, size, now, now)
+            )
+            self._conn.commit()
+        self._evict()
+
+    def _touch(self, key, refresh):
+        now = time.time()
+        with self._lock:
+            if refresh:
+                self._conn.execute("UPDATE pages SET accessed_at = ?, fetched_at = ? WHERE url = ?", (now, now, key))
+            else:
+                self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (now, key))
+            self._conn.commit()
+
+    def _evict(self):
+        """容量上限を超えていたらLRUで削除する"""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall()
+            victims = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM pages WHERE url = ?", victims)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        lookups = stats["hits"] + stats["revalidated"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["revalidated"]) / lookups if lookups else 0.0
+        stats["entries"], stats["bytes_stored"] = row
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """プロセス全体で共有するPageCacheを返す"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PageCache()
+    return _cache
@@ -0,0 +1,170 @@
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from tools.page_cache import normalize_url
+from tools.tracing import span, annotate, in_context
+from tools.dedup import suspend_dedup_turn
+
+# 検索結果の上位何件を先読みするか、同時に先読みする数、1件あたりのタイムアウト（秒）
+# AGENT_PREFETCH=1で既定で有効にする（prefetch_turn(enabled=...)で呼び出しごとにも切り替えられる）
+PREFETCH_ENABLED = os.environ.get("AGENT_PREFETCH", "0") == "1"
+PREFETCH_TOP_K = 2
+PREFETCH_MAX_WORKERS = 4
+PREFETCH_TIMEOUT_SEC = 10
+
+_current_turn = contextvars.ContextVar("prefetch_turn", default=None)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_stats = {"prefetched": 0, "hits": 0, "waited": 0, "failed": 0, "unused": 0, "cancelled": 0, "wasted_bytes": 0}
+_stats_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch")
+    return _pool
+
+
+def _count(**counts):
+    with _stats_lock:
+        for key, n in counts.items():
+            _stats[key] += n
+
+
+def _fetch(url, timeout_sec):
+    """1件を先読みし、(HTTPステータス, ダウンロードしたバイト数) を返す
+
+    200なら本文は共有のチャンクストアに入ります。
+    """
+    from tools.fetch_page import fetch_page
+
+    # 先読みの中のfetch_pageが、自分自身の先読みを待たないようにする
+    # （モデルに見せない取得なので、重複ページの検出の対象にもしない）
+    _current_turn.set(None)
+    suspend_dedup_turn()
+    with span("prefetch", "tool", url=url) as current:
+        # @tracedの内側を呼び、ダウンロードのバイト数などをこのスパンに記録する
+        result = fetch_page.func.__wrapped__(url, timeout_sec=timeout_sec)
+        current.set(status=result["status"])
+        return result["status"], current.attrs.get("bytes", 0)
+
+
+class PrefetchTurn:
+    """Agentの1回の実行の間だけ、検索結果の上位ページを裏で取得しておく
+
+    search_ddgが結果を返すとprefetch()で上位top_k件の取得を始め、モデルが
+    そのURLをfetch_pageに渡したときは、実行中の先読みならtake()で終わりを待ってから
+    共有のチャンクストアの本文を返します。close()で使われなかった先読みを
+    キャンセルし、無駄になったバイト数を数えます。
+    """
+
+    def __init__(self, top_k=PREFETCH_TOP_K, timeout_sec=PREFETCH_TIMEOUT_SEC):
+        self.top_k = top_k
+        self.timeout_sec = timeout_sec
+        self._futures = {}  # 正規化したURL -> Future（HTTPステータス, ダウンロードしたバイト数）
+        self._taken = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def prefetch(self, urls):
+        pool = _get_pool()
+        with self._lock:
+            if self._closed:
+                return
+            for url in [u for u in urls if u][:self.top_k]:
+                key = normalize_url(url)
+                if key not in self._futures:
+                    self._futures[key] = pool.submit(in_context(_fetch), url, self.timeout_sec)
+                    _count(prefetched=1)
+
+    def take(self, url, timeout_sec=None):
+        """urlの先読みが始まっていれば終わるまで待ち、本文がチャンクストアに入ったらTrueを返す
+
+        共有のプールで順番待ちのままの先読みはキャンセルしてFalseを返し、
+        呼び出し側でそのまま取得させます（待つと先読みしないより遅くなるため）。
+        先読みが失敗した（200以外だった）場合もFalseを返します。
+        """
+        key = normalize_url(url)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or key in self._taken:
+                return False
+            self._taken.add(key)
+        if future.cancel():
+            _count(cancelled=1)
+            annotate(prefetch="cancelled")
+            return False
+        in_flight = not future.done()
+        try:
+            status, _ = future.result(timeout=timeout_sec or self.timeout_sec)
+        except FutureTimeoutError:
+            return False
+        except Exception:
+            status = None
+        if status != 200:
+            # 先読みに失敗したら、呼び出し側でふつうに取得し直す（ヒットには数えない）
+            _count(failed=1)
+            annotate(prefetch="failed")
+            return False
+        _count(hits=1, waited=int(in_flight))
+        annotate(prefetch="waited" if in_flight else "hit")
+        return True
+
+    def close(self):
+        """使われなかった先読みを、始まっていなければキャンセルし、済んでいれば無駄として数える"""
+        with self._lock:
+            self._closed = True
+            unused = [f for key, f in self._futures.items() if key not in self._taken]
+        for future in unused:
+            if future.cancel():
+                _count(cancelled=1)
+                continue
+            _count(unused=1)
+            # 実行中のものは途中で止められないので、終わったときにバイト数を数える
+            future.add_done_callback(
+                lambda f: _count(wasted_bytes=f.result()[1]) if not f.cancelled() and f.exception() is None else None
+            )
+        annotate(prefetched=len(self._futures), prefetch_hits=len(self._taken & set(self._futures)))
+
+
+@contextmanager
+def prefetch_turn(enabled=None, **kwargs):
+    """Agentの1回の実行を囲み、その間の検索結果を先読みする（enabledがNoneなら既定の設定）"""
+    if not (PREFETCH_ENABLED if enabled is None else enabled):
+        yield None
+        return
+    turn = PrefetchTurn(**kwargs)
+    token = _current_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
+        turn.close()
+
+
+def prefetch_urls(urls):
+    """実行中のターンがあれば、urlsの上位を先読みする（search_ddgから呼ぶ）"""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.prefetch(urls)
+
+
+def take_prefetched(url, timeout_sec=None):
+    """urlが先読み中・先読み済みなら終わるまで待つ（fetch_pageから呼ぶ）"""
+    turn = _current_turn.get()
+    return turn is not None and turn.take(url, timeout_sec)
+
+
+def prefetch_stats():
+    """先読みの回数・ヒット率・失敗した数・使われなかった数・無駄になったバイト数"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["hit_ratio"] = stats["hits"] / stats["prefetched"] if stats["prefetched"] else 0.0
+    return stats
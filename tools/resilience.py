@@ -0,0 +1,247 @@
+import time
+import random
+import asyncio
+import threading
+from langchain_core.rate_limiters import BaseRateLimiter
+from tools.tracing import annotate
+
+# 上流ごとの既定のレート制限（1秒あたりの回数, バースト）。ホスト別の制限はページ取得に使う
+DDG_RATE_PER_SEC, DDG_BURST = 1.0, 3
+HOST_RATE_PER_SEC, HOST_BURST = 5.0, 5
+# リトライ（ジッター付き指数バックオフ）とサーキットブレーカーの既定値
+RETRY_ATTEMPTS = 3
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 8.0
+BREAKER_FAILURES = 5
+BREAKER_RESET_SEC = 30.0
+
+
+class TokenBucket(BaseRateLimiter):
+    """トークンバケット方式のレートリミッタ
+
+    1秒あたりrate_per_sec個のトークンが、最大burst個まで貯まります。
+    1回の呼び出しでトークンを1個使い、なければ貯まるまで待ちます。
+    BaseRateLimiterを継承しているので、ChatOpenAI(rate_limiter=...) にも渡せます。
+    """
+
+    def __init__(self, rate_per_sec, burst=1):
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_sec = 0.0
+
+    def _try_take(self):
+        """トークンを1個取る。取れなければ、次のトークンまでの秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_sec)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate_per_sec
+
+    def acquire(self, *, blocking=True):
+        started = time.monotonic()
+        while True:
+            wait_sec = self._try_take()
+            if wait_sec == 0.0:
+                self.waited_sec += time.monotonic() - started
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait_sec)
+
+    async def aacquire(self, *, blocking=True):
+        started = time.monotonic()
+        while True:
+            wait_sec = self._try_take()
+            if wait_sec == 0.0:
+                self.waited_sec += time.monotonic() - started
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(wait_sec)
+
+
+# 接続先（"ddg" / "fetch" / "host:<ホスト名>" など）ごとのレートリミッタ
+_limiters = {}
+_limiters_lock = threading.Lock()
+_host_limit = (HOST_RATE_PER_SEC, HOST_BURST)
+
+
+def set_rate_limit(name, rate_per_sec, burst=1):
+    """接続先nameのレート制限を設定する（rate_per_secがNoneなら制限を外す）"""
+    with _limiters_lock:
+        if rate_per_sec is None:
+            _limiters[name] = None
+            return None
+        _limiters[name] = TokenBucket(rate_per_sec, burst)
+        return _limiters[name]
+
+
+def set_host_rate_limit(rate_per_sec, burst=1):
+    """ホスト別のレート制限の既定値を変える（rate_per_secがNoneなら制限しない）"""
+    global _host_limit
+    with _limiters_lock:
+        _host_limit = (rate_per_sec, burst) if rate_per_sec is not None else None
+        for name in [n for n in _limiters if n.startswith("host:")]:
+            del _limiters[name]
+
+
+def get_rate_limiter(name):
+    """接続先nameのレートリミッタを返す（制限がなければNone）"""
+    limiter = _limiters.get(name)
+    if limiter is None and name not in _limiters and name.startswith("host:") and _host_limit:
+        with _limiters_lock:
+            if name not in _limiters:
+                _limiters[name] = TokenBucket(*_host_limit)
+            limiter = _limiters[name]
+    return limiter
+
+
+def throttle(name):
+    """接続先nameのレート制限があれば、呼び出してよくなるまで待つ（待った秒数を返す）"""
+    limiter = get_rate_limiter(name)
+    if limiter is None:
+        return 0.0
+    started = time.monotonic()
+    limiter.acquire()
+    return time.monotonic() - started
+
+
+set_rate_limit("ddg", DDG_RATE_PER_SEC, DDG_BURST)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    """サーキットブレーカーが開いているため、呼び出さずに失敗した"""
+
+
+class CircuitBreaker:
+    """連続した失敗が続く接続先への呼び出しを、しばらくの間すぐに失敗させる
+
+    failure_threshold回続けて失敗すると開き（open）、reset_sec経過後に
+    1回だけ試しに通します（half_open）。成功すれば閉じ、失敗すればまた開きます。
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_sec=BREAKER_RESET_SEC):
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_sec:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class _Upstream:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0}
+        self.throttled_sec = 0.0
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def _get_upstream(name):
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.setdefault(name, _Upstream())
+    return upstream
+
+
+def backoff_delay(attempt, base_sec=BACKOFF_BASE_SEC, max_sec=BACKOFF_MAX_SEC):
+    """attempt回目（0始まり）の失敗の後に待つ秒数（full jitter）"""
+    return random.uniform(0, min(max_sec, base_sec * 2 ** attempt))
+
+
+def call_upstream(name, func, retry_on=(), retry_if=None, attempts=RETRY_ATTEMPTS):
+    """レート制限・リトライ・サーキットブレーカーを通してfunc()を呼ぶ
+
+    retry_onの例外と、retry_if(result)がTrueを返す結果はバックオフして再試行します。
+    それ以外の例外は再試行せずに投げ直します。どちらもブレーカーでは失敗と数えます。
+    ブレーカーが開いていればCircuitOpenErrorをすぐに投げます。
+    最後の試行でもretry_ifに当たった場合は、その結果をそのまま返します。
+    """
+    upstream = _get_upstream(name)
+    for attempt in range(attempts):
+        if not upstream.breaker.allow():
+            upstream.count("rejected")
+            annotate(breaker="open")
+            raise CircuitOpenError(f"{name} is temporarily unavailable (circuit open)")
+        waited = throttle(name)
+        with upstream.lock:
+            upstream.counts["calls"] += 1
+            upstream.throttled_sec += waited
+        try:
+            result = func()
+        except retry_on:
+            upstream.breaker.record_failure()
+            upstream.count("failures")
+            if attempt == attempts - 1:
+                raise
+        except Exception:
+            upstream.breaker.record_failure()
+            upstream.count("failures")
+            raise
+        else:
+            if retry_if is None or not retry_if(result):
+                upstream.breaker.record_success()
+                upstream.count("successes")
+                return result
+            upstream.breaker.record_failure()
+            upstream.count("failures")
+            if attempt == attempts - 1:
+                return result
+        upstream.count("retries")
+        annotate(retries=attempt + 1)
+        time.sleep(backoff_delay(attempt))
+
+
+def upstream_stats():
+    """接続先ごとの呼び出し回数・失敗・リトライ・拒否・レート制限で待った時間・ブレーカーの状態"""
+    with _upstreams_lock:
+        upstreams = dict(_upstreams)
+    stats = {}
+    for name, upstream in upstreams.items():
+        with upstream.lock:
+            stats[name] = dict(upstream.counts, throttled_sec=upstream.throttled_sec, state=upstream.breaker.state)
+    return stats
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from tools.page_cache import CACHE_DIR
+
+# 検索結果キャッシュの有効期限・メモリ上の件数上限
+SEARCH_CACHE_TTL_SEC = 30 * 60
+SEARCH_CACHE_MAX_ENTRIES = 512
+# 1にするとディスク（SQLite）にも保存してセッションをまたいで使い回す
+SEARCH_CACHE_PERSIST = os.environ.get("AGENT_SEARCH_CACHE_PERSIST", "0") == "1"
+
+
+def normalize_query(query):
+    """検索クエリを正規化する
+
+    NFKCで全角英数・全角スペースなどを揃え、大文字小文字を同一視し、
+    連続する空白を1つにまとめます。
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(query.split())
+
+
+class _Flight:
+    """同じキーへの同時検索をまとめるための待ち合わせ"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SearchCache:
+    """検索結果のTTL付きキャッシュ（メモリ + 任意でSQLite）
+
+    (正規化したクエリ, region, backend) ごとに結果を保存し、
+    同じキーの同時検索は1回の上流呼び出しにまとめます（single-flight）。
+    """
+
+    def __init__(self, ttl_sec=SEARCH_CACHE_TTL_SEC, max_entries=SEARCH_CACHE_MAX_ENTRIES, path=None):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, limit, results)
+        self._flights = {}
+        self._stats = {"hits": 0, "misses": 0, "merged": 0}
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches "
+                "(key TEXT PRIMARY KEY, expires_at REAL, max_results INTEGER, results TEXT)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(query, region, backend):
+        return (normalize_query(query), region, backend)
+
+    def get_or_search(self, key, limit, search):
+        """キャッシュにあれば返し、なければsearch(limit)を1回だけ呼んで保存する"""
+        with self._lock:
+            results = self._lookup(key, limit)
+            if results is not None:
+                self._stats["hits"] += 1
+                return results
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self._stats["misses"] += 1
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats["merged"] += 1
+
+        if not leader:
+            # 先行している同じ検索の結果を待つ
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result[:limit]
+
+        try:
+            flight.result = search(limit)
+            self._store(key, limit, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _lookup(self, key, limit):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None and self._conn is not None:
+            row = self._conn.execute(
+                "SELECT expires_at, max_results, results FROM searches WHERE key = ?", (json.dumps(key),)
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], row[1], json.loads(row[2]))
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        expires_at, cached_limit, results = entry
+        # 期限切れ、または前回より多くの件数を要求された場合は取り直す
+        if expires_at < now or (cached_limit < limit and len(results) >= cached_limit):
+            return None
+        self._entries.move_to_end(key)
+        return results[:limit]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store(self, key, limit, results):
+        entry = (time.time() + self.ttl_sec, limit, results)
+        with self._lock:
+            self._remember(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                    (json.dumps(key), entry[0], limit, json.dumps(results, ensure_ascii=False))
+                )
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"] + stats["merged"]
+        stats["hit_ratio"] = (stats["hits"] + stats["merged"]) / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """プロセス全体で共有するSearchCacheを返す"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = None
+                if SEARCH_CACHE_PERSIST:
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    path = os.path.join(CACHE_DIR, "search.sqlite3")
+                _cache = SearchCache(path=path)
+    return _cache
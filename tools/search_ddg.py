@@ -1,7 +1,13 @@
 from itertools import islice
 from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import DuckDuckGoSearchException
 from langchain_core.tools import tool
 from langchain_core.pydantic_v1 import (BaseModel, Field)
+from tools.search_cache import get_search_cache
+from tools.tracing import traced, annotate
+from tools.resilience import call_upstream, UpstreamError
+from tools.prefetch import prefetch_urls
+from tools.dedup import dedup_results
 
 class SearchDDGInput(BaseModel):
     """正しく文字列で検索クエリが入ってくるようにする（Validator的な）
@@ -9,6 +15,7 @@ class SearchDDGInput(BaseModel):
     query: str = Field(description="検索したいキーワードを入力してください")
 
 @tool(args_schema=SearchDDGInput)
+@traced("search_ddg")
 def search_ddg(query, max_result_num=5):
     """
     ## Toolの説明
@@ -27,15 +34,43 @@ def search_ddg(query, max_result_num=5):
     - url
     """
 
-    # [1] Web検索を実施
-    res = DDGS().text(query, region='jp-jp', safesearch='off', backend="lite")
-
-    # [2] 結果のリストを分解して戻す
-    return [
-        {
-            "title": r.get('title', ""),
-            "snippet": r.get('body', ""),
-            "url": r.get('href', "")
-        }
-        for r in islice(res, max_result_num)
-    ]
\ No newline at end of file
+    region, backend = 'jp-jp', "lite"
+    annotate(query=query, cache_hit=True)
+
+    # [1] Web検索を実施（同じ・ほぼ同じクエリはキャッシュから返す）
+    def search(limit):
+        annotate(cache_hit=False)
+
+        def request():
+            res = DDGS().text(query, region=region, safesearch='off', backend=backend)
+
+            # [2] 結果のリストを分解して戻す
+            return [
+                {
+                    "title": r.get('title', ""),
+                    "snippet": r.get('body', ""),
+                    "url": r.get('href', "")
+                }
+                for r in islice(res, limit)
+            ]
+
+        # レート制限を守り、DuckDuckGo側の制限・一時的なエラーはバックオフして再試行する
+        return call_upstream("ddg", request, retry_on=(DuckDuckGoSearchException,))
+
+    cache = get_search_cache()
+    try:
+        results = cache.get_or_search(cache.make_key(query, region, backend), max_result_num, search)
+    except (UpstreamError, DuckDuckGoSearchException) as e:
+        # [3] 検索できなかったことを結果として返し、Agentのループは止めない
+        annotate(error=f"{type(e).__name__}: {e}")
+        return [{
+            "title": "検索エラー",
+            "snippet": f"Web検索に失敗しました（{type(e).__name__}）。しばらくしてから再度検索してください。",
+            "url": ""
+        }]
+    # 転載・ミラーなど同じ記事の重複を、取得する前に除く
+    results = dedup_results(results)
+    annotate(results=len(results))
+    # [4] モデルが次に取得しそうな上位のページを、モデルの応答を待つ間に取得しておく
+    prefetch_urls([r["url"] for r in results])
+    return results
@@ -0,0 +1,65 @@
+"""LangChainのLLM呼び出しをtools.tracingのスパンとして記録するコールバック
+
+langchain_coreのimportは重いので、LangChainを使わないアプリ（app_02.py / app_03.py）が
+tools.tracingを読み込むときに一緒に読み込まれないよう、別のモジュールにしています。
+"""
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from tools.tracing import Span, _current_span, _current_trace, _record
+
+
+def _token_usage(response):
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return {"prompt_tokens": metadata.get("input_tokens"), "completion_tokens": metadata.get("output_tokens")}
+    return {}
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """LangChainのLLM呼び出しを、時間・最初のトークンまでの時間・トークン数つきのスパンとして記録する"""
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, serialized, invocation_params=None, **attrs):
+        # コールバックは別スレッドから呼ばれることがあるので、開始時点のトレースを覚えておく
+        trace = _current_trace.get()
+        params = invocation_params or ((serialized or {}).get("kwargs") or {})
+        model = params.get("model") or params.get("model_name")
+        current = Span("llm", "llm", trace, _current_span.get(), {"model": model, **attrs})
+        with self._lock:
+            self._runs[run_id] = (current, trace)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+        self._start(run_id, serialized, invocation_params,
+                    prompt_chars=sum(len(str(m.content)) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, invocation_params=None, **kwargs):
+        self._start(run_id, serialized, invocation_params, prompt_chars=sum(len(p) for p in prompts))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        entry = self._runs.get(run_id)
+        if entry is not None and "ttft_sec" not in entry[0].attrs:
+            entry[0].set(ttft_sec=entry[0].elapsed())
+
+    def _end(self, run_id, **attrs):
+        with self._lock:
+            entry = self._runs.pop(run_id, None)
+        if entry is None:
+            return
+        current, trace = entry
+        current.set(**attrs)
+        current.end()
+        _record(current, trace)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, **_token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=f"{type(error).__name__}: {error}")
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from tools.page_cache import CACHE_DIR
+
+# スパンを書き出すJSONLファイル（サイズの上限でローテーションする）。AGENT_TRACE=0で書き出さない
+TRACE_ENABLED = os.environ.get("AGENT_TRACE", "1") == "1"
+TRACE_FILE = os.environ.get("AGENT_TRACE_FILE", os.path.join(CACHE_DIR, "traces.jsonl"))
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUP_COUNT = 5
+
+_current_trace = contextvars.ContextVar("agent_trace", default=None)
+_current_span = contextvars.ContextVar("agent_span", default=None)
+
+
+class Span:
+    """1つの処理（LLM呼び出し・ツール呼び出し・グラフのノードなど）の記録"""
+
+    def __init__(self, name, kind, trace=None, parent=None, attrs=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace.trace_id if trace else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.wall_sec = None
+        self.attrs = dict(attrs or {})
+        self._started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def end(self):
+        self.wall_sec = self.elapsed()
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "kind": self.kind, "start": self.start, "wall_sec": self.wall_sec,
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """1回の質問の処理で記録したスパンのまとめ（アプリのタイムライン表示用）"""
+
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.start = time.time()
+        self.root = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def set(self, **attrs):
+        self.root.set(**attrs)
+
+    def summary(self):
+        """スパン名ごとの回数と合計時間"""
+        totals = {}
+        for span in list(self.spans):
+            if span is self.root:
+                continue
+            total = totals.setdefault(span.name, {"count": 0, "wall_sec": 0.0})
+            total["count"] += 1
+            total["wall_sec"] += span.wall_sec or 0.0
+        return totals
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                logger = logging.getLogger("agent.trace")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                if not logger.handlers:
+                    os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+                    handler = RotatingFileHandler(
+                        TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8"
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def _record(span, trace):
+    if trace is not None:
+        trace.add(span)
+    if TRACE_ENABLED:
+        _get_logger().info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(name, kind="step", **attrs):
+    """処理の区間をスパンとして記録する（今のスパンの子になる）"""
+    trace = _current_trace.get()
+    current = Span(name, kind, trace, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        _record(current, trace)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """1回の質問の処理全体を記録する。中で記録したスパンはTraceに集まる"""
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        with span(name, "trace", **attrs) as root:
+            current.root = root
+            yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def annotate(**attrs):
+    """今のスパンに属性（バイト数・キャッシュのヒットなど）を追加する"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def traced(name, kind="tool"):
+    """関数の呼び出しをスパンとして記録するデコレータ（戻り値のstatusも記録する）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, kind) as current:
+                result = func(*args, **kwargs)
+                if isinstance(result, dict) and "status" in result:
+                    current.set(status=result["status"])
+                return result
+        return wrapper
+    return decorator
+
+
+def in_context(func):
+    """別スレッドで実行する関数に、今のトレースとスパンを引き継ぐ"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def timeline_markdown(trace, width=24, detail_chars=80):
+    """トレースのスパンを、開始順のタイムライン（Markdownの表）にする"""
+    spans = sorted(trace.spans, key=lambda s: s.start)
+    total = max((s.start - trace.start + (s.wall_sec or 0) for s in spans), default=0) or 1e-9
+    depth = {}
+    rows = ["| ステップ | 開始 | 時間 | | 詳細 |", "|---|---:|---:|---|---|"]
+    for s in spans:
+        depth[s.span_id] = depth.get(s.parent_id, -1) + 1
+        offset = s.start - trace.start
+        wall = s.wall_sec or 0.0
+        lead = int(offset / total * width)
+        bar = "·" * lead + "█" * max(1, min(width - lead, round(wall / total * width)))
+        # 長い文字列（URLなど）は後ろに回し、数値は丸めて表示する
+        attrs = sorted(s.attrs.items(), key=lambda kv: isinstance(kv[1], str) and len(kv[1]) > 40)
+        detail = ", ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in attrs)
+        if len(detail) > detail_chars:
+            detail = detail[:detail_chars] + "…"
+        name = "　" * depth[s.span_id] + s.name
+        rows.append(f"| {name} | {offset:.2f}秒 | {wall:.2f}秒 | `{bar}` | {detail.replace('|', '/')} |")
+    return "\n".join(rows)